@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+admission.py – 優先度付きアドミッション制御（過負荷時も投稿の受付を守る）
+────────────────────────────────────────
+- 同時に処理するイベントは ADMIT_LIMIT 件まで。空きが無ければクラスごとの待ち行列に並ぶ
+- 空いた枠は CHECKIN（画像/動画）→ QUERY（途中経過・ランキング・連続記録）→ NOVELTY（ネタ返し）
+  の順に渡す
+- NOVELTY は待ちが ADMIT_SHED_DEPTH 件以上なら即座に捨て、並んでも ADMIT_NOVELTY_WAIT 秒で諦める
+- CHECKIN / QUERY は捨てない（webhook の 200 を返す前に必ず処理する）
+- クラスごとの受付・破棄・エラー件数と待ち時間 / 処理時間を stats() で返す
+
+環境変数:
+  ADMIT_LIMIT          同時処理数（既定 4。gunicorn のスレッド数に合わせる）
+  ADMIT_SHED_DEPTH     これ以上待ちがあれば NOVELTY を捨てる（既定 2）
+  ADMIT_NOVELTY_WAIT   NOVELTY が待てる秒数（既定 5）
+"""
+
+from __future__ import annotations
+import os, time, threading, logging
+from collections import deque
+
+from logsetup import sampled_debug
+
+log = logging.getLogger(__name__)
+
+ADMIT_LIMIT   = int(os.getenv("ADMIT_LIMIT", "4"))
+SHED_DEPTH    = int(os.getenv("ADMIT_SHED_DEPTH", "2"))
+NOVELTY_WAIT  = float(os.getenv("ADMIT_NOVELTY_WAIT", "5"))
+
+CHECKIN, QUERY, NOVELTY = "checkin", "query", "novelty"
+CLASSES = (CHECKIN, QUERY, NOVELTY)            # 優先度の高い順
+
+RECENT = 256                                    # 分位点を出すために残す直近の件数
+
+
+class ClassStats:
+    def __init__(self):
+        self.admitted = 0
+        self.shed     = 0                       # 待ち行列が長くて即座に捨てた
+        self.expired  = 0                       # 並んだが時間切れ
+        self.errors   = 0
+        self.wait     = deque(maxlen=RECENT)    # 秒
+        self.total    = deque(maxlen=RECENT)    # 待ち + 処理（秒）
+
+    def summary(self) -> dict:
+        def ms(values, q):
+            if not values:
+                return 0.0
+            s = sorted(values)
+            return round(s[min(len(s) - 1, int(q * len(s)))] * 1000, 2)
+        return {
+            "admitted": self.admitted, "shed": self.shed, "expired": self.expired,
+            "errors": self.errors,
+            "wait_ms":  {"p50": ms(self.wait, 0.5), "p95": ms(self.wait, 0.95),
+                         "max": ms(self.wait, 1.0)},
+            "total_ms": {"p50": ms(self.total, 0.5), "p95": ms(self.total, 0.95),
+                         "max": ms(self.total, 1.0)},
+        }
+
+
+class Admission:
+    def __init__(self, limit: int = ADMIT_LIMIT, shed_depth: int = SHED_DEPTH,
+                 novelty_wait: float = NOVELTY_WAIT):
+        self.limit   = max(1, limit)
+        self.shed_depth = shed_depth
+        self.max_wait = {CHECKIN: None, QUERY: None, NOVELTY: novelty_wait}
+        self.running = 0
+        self.waiting: dict[str, deque] = {c: deque() for c in CLASSES}
+        self.lock    = threading.Lock()
+        self.metrics = {c: ClassStats() for c in CLASSES}
+
+    def depth(self) -> int:
+        return sum(len(q) for q in self.waiting.values())
+
+    def _acquire(self, klass: str) -> bool:
+        with self.lock:
+            if klass == NOVELTY and self.depth() >= self.shed_depth:
+                self.metrics[klass].shed += 1
+                return False
+            if self.running < self.limit:
+                self.running += 1
+                return True
+            ev = threading.Event()
+            self.waiting[klass].append(ev)
+        if ev.wait(self.max_wait[klass]):
+            return True                         # 枠を譲り受けた（running はそのまま）
+        with self.lock:
+            if ev.is_set():                     # 時間切れと同時に譲られた
+                return True
+            self.waiting[klass].remove(ev)
+            self.metrics[klass].expired += 1
+            return False
+
+    def _release(self):
+        with self.lock:
+            for c in CLASSES:
+                if self.waiting[c]:
+                    self.waiting[c].popleft().set()
+                    return
+            self.running -= 1
+
+    def run(self, klass: str, fn, *args) -> bool:
+        """枠が取れたら fn を実行して True。捨てたら False"""
+        start = time.monotonic()
+        if not self._acquire(klass):
+            sampled_debug(log, "admission dropped", {"class": klass, "depth": self.depth()})
+            return False
+        m = self.metrics[klass]
+        began = time.monotonic()
+        ok = False
+        try:
+            fn(*args)
+            ok = True
+        finally:
+            self._release()
+            end = time.monotonic()
+            with self.lock:
+                if ok:                          # 例外で抜けたものは errors にだけ数える
+                    m.admitted += 1
+                else:
+                    m.errors += 1
+                m.wait.append(began - start)
+                m.total.append(end - start)
+        return True
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"limit": self.limit, "running": self.running,
+                    "waiting": {c: len(q) for c, q in self.waiting.items()},
+                    "classes": {c: m.summary() for c, m in self.metrics.items()}}
@@ -5,33 +5,44 @@ LINE Bot (Render)
 - 画像/動画を受信 → 大学サーバー /record へ POST
 - 固定フレーズ応答
 - "<名前>途中経過" で忘れ回数返答
+- 過負荷時は投稿 → 問い合わせ → ネタ返しの順に処理し、ネタ返しは捨てる（admission.py）
 """
 
 from __future__ import annotations
-import os, json, csv
+import os, logging
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 
 import requests
 from dotenv import load_dotenv
-from flask import Flask, request, abort
+from flask import Flask, request, abort, jsonify
 from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import LineBotApiError
 from linebot.models import (
     MessageEvent, ImageMessage, VideoMessage,
-    TextMessage, TextSendMessage
+    TextMessage
 )
 
+from admission import Admission, CHECKIN, QUERY, NOVELTY
+from dispatcher import Dispatcher
+from logsetup import setup_logging, sampled_debug
+from ledger import Ledger, settle
+from profiles import MemberRegistry
+from profiling import profiler, authorized
+from stats import Stats
+from stats_api import StatsView
+from store import CheckinStore
+
 # ────────────────── パス固定
 BASE_DIR = Path(__file__).resolve().parent  # /opt/render/project/src/musclebot
 os.chdir(BASE_DIR)                          # 以降の相対パスは musclebot 内
 
-LOG_PATH       = Path("log.json")
 MEMBERS_PATH   = Path("members.json")
 DAILY_CSV_PATH = Path("daily.csv")
 
 # ────────────────── .env / Render env
 load_dotenv()
+setup_logging("bot.log", per_process=True)   # gunicorn ワーカーごとに別ファイル
+log = logging.getLogger("bot")
 LINE_TOKEN      = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
 LINE_SECRET     = os.getenv("LINE_CHANNEL_SECRET")
 LINE_GROUP_ID   = "C1d9ed412f2141da57e47bd28cec532a4"
@@ -41,32 +52,38 @@ NGROK_RECORD_URL = (os.getenv("NGROK_RECORD_URL") or "").rstrip("/")
 if NGROK_RECORD_URL:
     ENDPOINT = f"{NGROK_RECORD_URL}/record"
 else:
-    print("⚠️ NGROK_RECORD_URL 未設定。大学サーバー通知はスキップします。")
+    log.warning("NGROK_RECORD_URL 未設定。大学サーバー通知はスキップします")
     ENDPOINT = None
 
 # ────────────────── Flask / LINE 初期化
 app     = Flask(__name__)
 bot     = LineBotApi(LINE_TOKEN)
+dispatcher = Dispatcher(bot)
+ledger     = Ledger(DAILY_CSV_PATH, MEMBERS_PATH)
+store      = CheckinStore()   # 初回起動時に log.json を取り込む。index.shm は全ワーカーで共有
+registry   = MemberRegistry(bot, LINE_GROUP_ID, ledger, MEMBERS_PATH, index=store.index)
+stats      = Stats()
+stats_view = StatsView(ledger, registry, stats)
+admission  = Admission()
 handler = WebhookHandler(LINE_SECRET)
 JST     = timezone(timedelta(hours=9))
 
-if not LOG_PATH.exists():
-    LOG_PATH.write_text("{}", encoding="utf-8")
-
 # ────────────────── Webhook
 @app.before_request
 def _debug():
+    # DEBUG 有効時もサンプルした一部のリクエストだけ
     if request.path == "/callback":
-        print("🔔 /callback hit")
+        sampled_debug(log, "/callback hit", lambda: {"remote": request.remote_addr})
 
 @app.route("/callback", methods=["POST"])
 def callback():
     signature = request.headers.get("X-Line-Signature", "")
     body      = request.get_data(as_text=True)
     try:
-        handler.handle(body, signature)
+        with profiler.profile("callback"):
+            handler.handle(body, signature)
     except Exception as e:
-        print("❌ Webhook handling error:", e)
+        log.warning("Webhook handling error", extra={"error": str(e)})
         abort(400)
     return "OK"
 
@@ -77,48 +94,36 @@ def handle_media(event):
         return
 #    if event.message.content_provider.type != "line":
 #        return
+    admission.run(CHECKIN, check_in, event)
 
+def check_in(event):
     uid   = event.source.user_id
     now   = datetime.now(JST)
     today = now.strftime("%Y-%m-%d")
     now_iso = now.isoformat()
-    print(f"📸 uid='{uid}' today='{today}' {now.time()}")
+    log.info("media received", extra={"uid": uid, "day": today})
 
-    # 名前解決
-    name = uid
-    if MEMBERS_PATH.exists():
-        try:
-            name = json.loads(MEMBERS_PATH.read_text()).get(uid, uid)
-        except Exception as e:
-            print("⚠️ members.json 読込失敗:", e)
-
-    # log.json 更新
-    logs = json.loads(LOG_PATH.read_text())
-    logs.setdefault(name, [])
-#    if any(str(e).startswith(today) for e in logs[name]):
-#       safe_reply("すでに今日の投稿は受け取っています！", event)
-#       return
-    if any(entry.get("date") == today for entry in logs[name] if isinstance(entry, dict)):
+    # 名前解決（未登録ならプロフィール API で自動登録）
+    name = registry.name_for(uid)
+
+    # store/ に追記（同じ日の 2 回目以降は受け付けない）
+    if not store.append_if_new(uid, now_iso):
         safe_reply("すでに今日の投稿は受け取っています！", event)
-        return 
-   logs[name].append({
-        "date": today,
-        "ts": now_iso
-    })
-    LOG_PATH.write_text(json.dumps(logs, ensure_ascii=False, indent=2))
-    print("✅ log.json 追記 OK")
+        return
+    log.info("store 追記 OK", extra={"uid": uid})
+    stats.check_in(uid, name, now.date())
 
     # 大学サーバーへ
     if ENDPOINT:
         try:
             res = requests.post(
-                ENDPOINT, json={"user_id": uid, "date": today}, timeout=5
+                ENDPOINT, json={"user_id": uid, "date": today, "ts": now_iso}, timeout=5
             )
-            print("📡 record.py status:", res.status_code, res.text[:120])
+            log.info("record.py 応答", extra={"status": res.status_code, "body": res.text[:120]})
         except requests.exceptions.RequestException as e:
-            print("❌ 大学サーバー送信失敗:", e)
+            log.warning("大学サーバー送信失敗", extra={"error": str(e)})
     else:
-        print("⚠️ endpoint 未設定 → 送信スキップ")
+        log.debug("endpoint 未設定 → 送信スキップ")
 
     safe_reply("受け取りました！", event)
 
@@ -126,36 +131,55 @@ def handle_media(event):
 @handler.add(MessageEvent, message=TextMessage)
 def handle_text(event):
     txt = event.message.text.strip()
+    if txt.endswith("途中経過"):
+        admission.run(QUERY, send_progress, txt.replace("途中経過", "").strip(), event)
+    elif txt == "ランキング":
+        admission.run(QUERY, send_ranking, event)
+    elif txt.endswith("連続記録"):
+        admission.run(QUERY, send_streak, txt.replace("連続記録", "").strip(), event)
+    else:
+        answer = novelty_reply(txt)
+        if answer:                   # 混んでいれば捨てる（返事が無いだけ）
+            admission.run(NOVELTY, reply, answer, event)
+
+def novelty_reply(txt: str) -> str | None:
     if txt == "何が好き？":
-        reply("チョコミントよりもあ・な・た", event)
-    elif txt.endswith("募"):
-        reply("🉑", event)
-    elif txt.endswith("ちゃん！"):
-        reply("はーい", event)
-    elif txt.endswith("ちんげのきたろう"):
-        reply("受け取りました：ちんげのきたろう", event)
-    elif txt.endswith("ダディダディ"):
-        reply(f"どすこいわっしょいピーポーピーポ―{txt}～", event)
-    elif txt.endswith("途中経過"):
-        send_progress(txt.replace("途中経過", "").strip(), event)
+        return "チョコミントよりもあ・な・た"
+    if txt.endswith("募"):
+        return "🉑"
+    if txt.endswith("ちゃん！"):
+        return "はーい"
+    if txt.endswith("ちんげのきたろう"):
+        return "受け取りました：ちんげのきたろう"
+    if txt.endswith("ダディダディ"):
+        return f"どすこいわっしょいピーポーピーポ―{txt}～"
+    return None
 
 # ────────────────── 途中経過
 def send_progress(name: str, event):
     if not (MEMBERS_PATH.exists() and DAILY_CSV_PATH.exists()):
         reply("データがありません。", event); return
-    names = list(json.loads(MEMBERS_PATH.read_text()).values())
-    if name not in names:
+    uid = next((u for u, n in registry.members().items() if n == name), None)
+    if uid is None:
         reply("その名前は登録されていません。", event); return
-    idx = names.index(name)
-    rows = csv.reader(open(DAILY_CSV_PATH, encoding="utf-8"))
-    missed = sum(1 for r in rows if len(r) > idx and r[idx] == "1")
-    reply(f"{name}は今月{missed}回忘れてます", event)
+    _, missed = settle(ledger.days())
+    reply(f"{name}は今月{missed.get(uid, 0)}回忘れてます", event)
+
+# ────────────────── ランキング
+def send_ranking(event):
+    reply(stats.ranking_text(), event)
+
+# ────────────────── 連続記録
+def send_streak(name: str, event):
+    text = stats.streak_text(name)
+    reply(text if text else "その名前の記録はありません。", event)
 
 # ────────────────── ヘルパ
-def reply(msg: str, event):       bot.reply_message(event.reply_token, TextSendMessage(text=msg))
-def safe_reply(msg: str, event):
-    try: bot.reply_message(event.reply_token, TextSendMessage(text=msg))
-    except LineBotApiError: pass
+def reply(msg: str, event):
+    # reply が失敗したらグループ宛 push（outbox 経由）で届ける
+    fallback = event.source.group_id if event.source.type == "group" else None
+    dispatcher.reply(event.reply_token, msg, fallback_to=fallback)
+def safe_reply(msg: str, event):  dispatcher.reply(event.reply_token, msg)
 
 @app.route("/", methods=["GET"])
 def index(): return "LINE bot is alive"
@@ -164,5 +188,31 @@ def index(): return "LINE bot is alive"
 @app.route("/files", methods=["GET"])
 def list_files(): return {"files": os.listdir(BASE_DIR)}
 
+# ダッシュボード用 JSON（ETag / 304 対応）
+@app.route("/api/<any(progress, balances, streaks):kind>", methods=["GET"])
+def api_stats(kind: str):
+    status, body, etag = stats_view.get(kind, request.headers.get("If-None-Match"))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if status == 200:
+        headers["Content-Type"] = "application/json; charset=utf-8"
+    return body, status, headers
+
+# プロファイル結果（PROFILE_RATE > 0 かつ PROFILE_TOKEN 一致時のみ）
+@app.route("/debug/profile", methods=["GET"])
+def debug_profile():
+    if not profiler.enabled or not authorized(request.headers.get("X-Profile-Token")):
+        abort(404)
+    paths = profiler.dump()
+    if request.args.get("format") == "collapsed":
+        return profiler.collapsed(), 200, {"Content-Type": "text/plain; charset=utf-8"}
+    return jsonify({**profiler.summary(), "files": [p.name for p in paths]})
+
+# 優先度別の待ち時間・破棄件数（PROFILE_TOKEN 一致時のみ）
+@app.route("/debug/admission", methods=["GET"])
+def debug_admission():
+    if not authorized(request.headers.get("X-Profile-Token")):
+        abort(404)
+    return jsonify(admission.stats())
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
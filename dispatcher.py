@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+dispatcher.py – LINE 送信ディスパッチャ
+────────────────────────────────────────
+- push は outbox/ に 1 通 1 ファイルで永続化してから送信（失敗しても消えない）
+- トークンバケットで API 呼び出しをレート制限
+- 429 は Retry-After を尊重、5xx / 通信エラーは指数バックオフで再試行
+  （reply だけは通信エラーで再試行せず、すぐ push に切り替える）
+- 長文は 5000 文字ごとに分割（1 リクエスト最大 5 メッセージ）
+
+使い方（cron で取り残しを再送）:
+    python dispatcher.py
+"""
+
+from __future__ import annotations
+import os, json, time, uuid, fcntl, threading, logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from linebot.exceptions import LineBotApiError
+from linebot.models import TextSendMessage
+
+from store import write_atomic
+
+BASE = Path(__file__).resolve().parent
+
+log = logging.getLogger(__name__)
+
+OUTBOX_DIR = BASE / "outbox"
+
+TEXT_LIMIT    = 5000     # LINE テキスト 1 通の上限
+MSGS_PER_CALL = 5        # push/reply 1 回で送れるメッセージ数
+MAX_ATTEMPTS  = 8        # outbox の 1 通あたり最大試行回数（超えたら dead/ へ）
+REPLY_TRIES   = 3        # reply token は短命なので少なめ
+BACKOFF_BASE  = 1.0
+BACKOFF_MAX   = 300.0
+
+# 既定は控えめ。LINE 側の上限に合わせて環境変数で引き上げ可
+RATE_PER_SEC = float(os.getenv("LINE_RATE_PER_SEC", "10"))
+RATE_BURST   = int(os.getenv("LINE_RATE_BURST", "20"))
+
+
+# ────────────────── テキスト分割
+def split_text(text: str, limit: int = TEXT_LIMIT) -> list[str]:
+    """limit 文字以内に分割。できるだけ改行位置で切る"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+def batches(texts: list[str]) -> list[list[str]]:
+    return [texts[i:i + MSGS_PER_CALL] for i in range(0, len(texts), MSGS_PER_CALL)]
+
+
+# ────────────────── トークンバケット
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate   = rate
+        self.burst  = burst
+        self.tokens = float(burst)
+        self.stamp  = time.monotonic()
+        self.lock   = threading.Lock()
+        self.paused_until = 0.0    # 429 を受けたら全体で待つ
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                    self.stamp  = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+# ────────────────── エラー分類
+def _retry_after(e: LineBotApiError) -> float | None:
+    headers = getattr(e, "headers", None) or {}
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def classify(e: Exception) -> tuple[bool, float | None]:
+    """(再試行すべきか, サーバ指定の待ち秒数)"""
+    if isinstance(e, LineBotApiError):
+        status = getattr(e, "status_code", 0) or 0
+        if status == 429:
+            return True, _retry_after(e)
+        return status >= 500, None
+    if isinstance(e, requests.exceptions.RequestException):
+        return True, None
+    return False, None
+
+
+def backoff(attempt: int) -> float:
+    return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+
+
+# ────────────────── ディスパッチャ本体
+class Dispatcher:
+    def __init__(self, api, outbox: Path = OUTBOX_DIR,
+                 rate: float = RATE_PER_SEC, burst: int = RATE_BURST):
+        self.api    = api
+        self.outbox = Path(outbox)
+        self.bucket = TokenBucket(rate, burst)
+        self.flush_lock = threading.Lock()
+
+    # ---------- API 呼び出し（レート制限 + 429 の共有待ち）
+    def _call(self, fn, *args, **kwargs):
+        self.bucket.acquire()
+        try:
+            return fn(*args, **kwargs)
+        except LineBotApiError as e:
+            if getattr(e, "status_code", 0) == 429:
+                self.bucket.pause(_retry_after(e) or backoff(0))
+            raise
+
+    # ---------- reply
+    def reply(self, reply_token: str, text: str, fallback_to: str | None = None) -> bool:
+        """429 / 5xx だけ reply を短く再試行。失敗したら fallback_to 宛に push を outbox へ回す"""
+        chunks = split_text(text)
+        first, rest = chunks[:MSGS_PER_CALL], chunks[MSGS_PER_CALL:]
+        for attempt in range(REPLY_TRIES):
+            try:
+                self._call(self.api.reply_message, reply_token,
+                           [TextSendMessage(text=t) for t in first])
+                break
+            except Exception as e:
+                retry, wait = classify(e)
+                log.warning("reply 失敗", extra={"attempt": attempt + 1, "error": str(e)})
+                # 通信エラーは届いたかどうか分からない。同じ token で再送すると 400 が返り、
+                # 届いていた場合でも push を重ねてしまうので、再試行せずすぐ push に回す
+                ambiguous = isinstance(e, requests.exceptions.RequestException)
+                if not retry or ambiguous or attempt == REPLY_TRIES - 1:
+                    if fallback_to:
+                        self.push(fallback_to, text)
+                    return False
+                time.sleep(min(wait or backoff(attempt), 5))
+        if rest and fallback_to:
+            self.push(fallback_to, "\n".join(rest))
+        return True
+
+    # ---------- push（outbox 経由）
+    def enqueue(self, to: str, text: str) -> list[Path]:
+        """送信前に outbox へ書き出す。戻り値は作成したファイル"""
+        self.outbox.mkdir(exist_ok=True)
+        paths = []
+        for i, group in enumerate(batches(split_text(text))):
+            item = {
+                "id": uuid.uuid4().hex,          # X-Line-Retry-Key にも使う
+                "to": to,
+                "texts": group,
+                "attempts": 0,
+                "next_at": 0.0,
+                "created": time.time(),
+            }
+            # ファイル名の時刻 + 連番で送信順を保つ
+            path = self.outbox / f"{time.time_ns():020d}_{i:03d}_{item['id']}.json"
+            _write_atomic(path, item)
+            paths.append(path)
+        return paths
+
+    def push(self, to: str, text: str) -> bool:
+        """outbox に積んでから即時送信を試みる。全部届いたら True"""
+        paths = self.enqueue(to, text)
+        return all(self._deliver(p) for p in paths)
+
+    def _deliver(self, path: Path) -> bool:
+        """1 通送る。読み → 送信 → 書き戻しは <名前>.lock の flock 中に行う（cron と bot が同時に触るため）"""
+        lock = path.with_suffix(".lock")
+        with open(lock, "a") as lk:
+            try:
+                fcntl.flock(lk, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False       # 別プロセスが送信中（届いたかは次の flush で分かる）
+            try:
+                return self._send(path)
+            finally:
+                if not path.exists():          # 片付いたらロックファイルも消す（残っている間は使い回す）
+                    lock.unlink(missing_ok=True)
+                fcntl.flock(lk, fcntl.LOCK_UN)
+
+    def _send(self, path: Path) -> bool:
+        try:
+            item = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return True            # 別スレッド / 別プロセスが送信済み
+        except json.JSONDecodeError as e:
+            log.error("outbox 破損", extra={"file": path.name, "error": str(e)})
+            _move_dead(path)
+            return False
+
+        if item.get("next_at", 0) > time.time():
+            return False
+
+        try:
+            self._call(self.api.push_message, item["to"],
+                       [TextSendMessage(text=t) for t in item["texts"]],
+                       retry_key=item["id"])
+        except Exception as e:
+            # 409 = 同じ retry key が受理済み → 送信成功扱い
+            if isinstance(e, LineBotApiError) and getattr(e, "status_code", 0) == 409:
+                path.unlink(missing_ok=True)
+                return True
+            retry, wait = classify(e)
+            item["attempts"] += 1
+            item["last_error"] = str(e)[:200]
+            if not retry or item["attempts"] >= MAX_ATTEMPTS:
+                log.error("push 断念", extra={"file": path.name, "error": str(e)})
+                _write_atomic(path, item)
+                _move_dead(path)
+                return False
+            item["next_at"] = time.time() + (wait or backoff(item["attempts"]))
+            _write_atomic(path, item)
+            log.warning("push 失敗 → 再送予定",
+                        extra={"attempt": item["attempts"], "file": path.name, "error": str(e)})
+            return False
+
+        path.unlink(missing_ok=True)
+        return True
+
+    def pending(self) -> list[Path]:
+        if not self.outbox.exists():
+            return []
+        return sorted(self.outbox.glob("*.json"))
+
+    def flush(self, workers: int = 4, wait: bool = False, timeout: float = 600) -> int:
+        """outbox を送信。宛先ごとに順序を保ちつつ、宛先間は並列。残件数を返す"""
+        deadline = time.time() + timeout
+        with self.flush_lock:
+            while True:
+                by_dest: dict[str, list[Path]] = {}
+                for p in self.pending():
+                    try:
+                        to = json.loads(p.read_text(encoding="utf-8"))["to"]
+                    except Exception:
+                        to = ""
+                    by_dest.setdefault(to, []).append(p)
+
+                def run(paths):
+                    for p in paths:
+                        if not self._deliver(p):
+                            break       # 同じ宛先の後続は追い越させない
+
+                with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                    list(pool.map(run, by_dest.values()))
+
+                left = self.pending()
+                if not left or not wait or time.time() >= deadline:
+                    return len(left)
+                next_at = min(_next_at(p) for p in left)
+                time.sleep(max(0.1, min(next_at - time.time(), deadline - time.time())))
+
+
+# ────────────────── ファイル操作
+def _write_atomic(path: Path, item: dict):
+    write_atomic(path, json.dumps(item, ensure_ascii=False))
+
+
+def _move_dead(path: Path):
+    dead = path.parent / "dead"
+    dead.mkdir(exist_ok=True)
+    if path.exists():
+        os.replace(path, dead / path.name)
+
+
+def _next_at(path: Path) -> float:
+    try:
+        return json.loads(path.read_text(encoding="utf-8")).get("next_at", 0.0)
+    except Exception:
+        return 0.0
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from linebot import LineBotApi
+    from logsetup import setup_logging
+
+    load_dotenv()
+    setup_logging("dispatcher.log", stream=False)
+    d = Dispatcher(LineBotApi(os.getenv("LINE_CHANNEL_ACCESS_TOKEN")))
+    left = d.flush(wait=True, timeout=240)
+    log.info("outbox 再送完了", extra={"left": left})
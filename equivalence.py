@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""
+equivalence.py – 旧ロジックと高速化後の経路が同じ結果を出すかの突き合わせ + 計測
+────────────────────────────────────────
+同じデータを旧形式（log.json / 見出し無し daily.csv）と新形式（store/ / uid 見出し付き
+台帳）の両方に流し、次を比べる:
+
+  daily    daily_check11.py（名前 → [{"date","ts"}]）
+           daily_check.py2（名前 → ["ts"]）
+           musclebot/daily_check.py（uid → ["ts"]）
+             ⇔ CheckinStore.posted_on + Ledger.append_day（今の daily_check.py）
+             ⇔ rebuild.bucket + build_days
+  monthly  monthly_report.py の精算ループ ⇔ ledger.settle
+
+1 日でも 1 円でも食い違えば終了コード 1。旧ロジックは各スクリプトの判定部分を
+そのまま関数にしたもの（LINE 送信とファイル書き込みは除く）。
+
+例:
+    python equivalence.py                       # 合成データ + 手元の log.json / daily.csv
+    python equivalence.py --members 30 --days 730 --runs 31
+"""
+
+from __future__ import annotations
+import sys, csv, json, time, random, argparse, tempfile
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+import store as store_mod
+from ledger import Ledger, settle
+from rebuild import bucket, build_days
+from store import CheckinStore
+
+BASE = Path(__file__).resolve().parent
+
+# Asia/Tokyo は 1951 年以降夏時間が無いので、pytz.localize と固定 +09:00 は同じ
+JST = timezone(timedelta(hours=9))
+
+BAD_TS = ["", "not-a-date", "{d}T25:00:00", "{d}T10:61", "{d}Tnoon", "{y}-13-01T10:00:00"]
+
+
+# ────────────────── 旧ロジック（判定部分のみ）
+def _window(ydate: date) -> tuple[datetime, datetime]:
+    start = datetime.combine(ydate, datetime.min.time()).replace(tzinfo=JST)
+    end   = datetime.combine(ydate, datetime.max.time()).replace(tzinfo=JST)
+    return start, end
+
+
+def _in_window(ts, start, end) -> bool:
+    dt = datetime.fromisoformat(ts)
+    dt = (dt if dt.tzinfo else dt.replace(tzinfo=JST)).astimezone(JST)
+    return start <= dt <= end
+
+
+def legacy_daily_11(logs: dict, id_to_name: dict, ydate: date) -> list[int]:
+    """daily_check11.py: 名前キー、エントリは {"date", "ts"}"""
+    start, end = _window(ydate)
+    row = []
+    for uid, name in id_to_name.items():
+        posted = False
+        for entry in logs.get(name, []):
+            try:
+                ts = entry.get("ts")
+                if not ts:
+                    continue
+                if _in_window(ts, start, end):
+                    posted = True
+                    break
+            except Exception:
+                pass
+        row.append(0 if posted else 1)
+    return row
+
+
+def legacy_daily_py2(logs: dict, id_to_name: dict, ydate: date) -> list[int]:
+    """daily_check.py2: 名前キー、エントリは ts 文字列"""
+    start, end = _window(ydate)
+    row = []
+    for uid, name in id_to_name.items():
+        posted = False
+        for ts in logs.get(name, []):
+            try:
+                if _in_window(ts, start, end):
+                    posted = True
+                    break
+            except Exception:
+                pass
+        row.append(0 if posted else 1)
+    return row
+
+
+def legacy_daily_musclebot(logs: dict, id_to_name: dict, ydate: date) -> list[int]:
+    """musclebot/daily_check.py: uid キー、エントリは ts 文字列"""
+    start, end = _window(ydate)
+    row = []
+    for uid in id_to_name:
+        posted = False
+        for t in logs.get(uid, []):
+            try:
+                if _in_window(t, start, end):
+                    posted = True
+                    break
+            except Exception:
+                pass
+        row.append(0 if posted else 1)
+    return row
+
+
+def legacy_monthly(rows: list[list[str]], n: int) -> list[float]:
+    """monthly_report.py: 見出し無し daily.csv → メンバー順の収支"""
+    meibo = [0] * n
+    for day in rows:
+        if len(day) != n:
+            continue
+        fine_cnt = sum(1 for v in day if int(v) == 1)
+        exclude_cnt = sum(1 for v in day if int(v) == 2)
+        if (n - fine_cnt - exclude_cnt) > 0:
+            amount = 200 * fine_cnt / (n - fine_cnt - exclude_cnt)
+        else:
+            amount = 0
+        for j, v in enumerate(map(int, day)):
+            if v == 0:
+                meibo[j] += amount
+            elif v == 1:
+                meibo[j] -= 200
+    return meibo
+
+
+# ────────────────── データセット
+class Dataset:
+    """同じ投稿を uid ごとの ts 列で持ち、旧形式の各ビューを作る"""
+
+    def __init__(self, label: str, id_to_name: dict[str, str], posts: dict[str, list[str]],
+                 days: list[date], exclusions: dict[str, set[str]], csv_rows=None):
+        self.label      = label
+        self.id_to_name = id_to_name
+        self.posts      = posts                 # uid → [ts]（壊れた ts も含む）
+        self.days       = days                  # daily_check を走らせる「昨日」
+        self.exclusions = exclusions            # 日付 → 2 を付ける uid
+        self.csv_rows   = csv_rows              # 実物の daily.csv（あれば）
+
+    def by_name_entries(self) -> dict:
+        return {self.id_to_name[u]: [{"date": ts[:10], "ts": ts} for ts in v]
+                for u, v in self.posts.items()}
+
+    def by_name(self) -> dict:
+        return {self.id_to_name[u]: list(v) for u, v in self.posts.items()}
+
+    def by_uid(self) -> dict:
+        return {u: list(v) for u, v in self.posts.items()}
+
+
+def synthetic(members: int, ndays: int, seed: int) -> Dataset:
+    rng = random.Random(seed)
+    uids = [f"U{rng.getrandbits(128):032x}" for _ in range(members)]
+    id_to_name = {u: f"member{i:02d}" for i, u in enumerate(uids)}
+    end = datetime.now(JST).date() - timedelta(days=1)
+    days = [end - timedelta(days=i) for i in range(ndays - 1, -1, -1)]
+    skill = {u: rng.uniform(0.5, 0.95) for u in uids}
+    posts: dict[str, list[str]] = {u: [] for u in uids}
+    exclusions: dict[str, set[str]] = {}
+    for d in days:
+        for u in uids:
+            if rng.random() < 0.03:
+                exclusions.setdefault(d.isoformat(), set()).add(u)
+            n = rng.choice((1, 1, 1, 2)) if rng.random() < skill[u] else 0
+            for _ in range(n):
+                sec = rng.randrange(86400)
+                local = datetime.combine(d, datetime.min.time()) + timedelta(seconds=sec, microseconds=rng.randrange(10 ** 6))
+                form = rng.random()
+                if form < 0.6:                  # bot.py の素の JST
+                    ts = local.isoformat()
+                elif form < 0.8:                # オフセット付き JST
+                    ts = local.replace(tzinfo=JST).isoformat()
+                elif form < 0.95:               # UTC（日付をまたぐ時刻も含む）
+                    ts = local.replace(tzinfo=JST).astimezone(timezone.utc).isoformat()
+                else:                           # Z 表記
+                    ts = local.replace(tzinfo=JST).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                posts[u].append(ts)
+            if rng.random() < (0.2 if n == 0 else 0.01):     # 壊れた ts しか無い日も作る
+                posts[u].append(rng.choice(BAD_TS).format(d=d.isoformat(), y=d.year))
+    for v in posts.values():
+        rng.shuffle(v)                          # 追記順に依存していないこと
+    return Dataset(f"synthetic {members}人×{ndays}日", id_to_name, posts, days, exclusions)
+
+
+def real(base: Path) -> Dataset | None:
+    """手元の log.json / members.json / daily.csv（読むだけ）"""
+    try:
+        id_to_name = json.loads((base / "members.json").read_text(encoding="utf-8"))
+        logs = json.loads((base / "log.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 実データを読めないので飛ばします: {e}")
+        return None
+    name_to_id = {n: u for u, n in id_to_name.items()}
+    posts = {u: [] for u in id_to_name}
+    for key, entries in logs.items():
+        uid = name_to_id.get(key, key)
+        if uid not in posts:
+            continue
+        for e in entries:
+            ts = e.get("ts") if isinstance(e, dict) else e
+            if isinstance(ts, str):
+                posts[uid].append(ts)
+    stamps = sorted(ts[:10] for v in posts.values() for ts in v if ts[:4].isdigit())
+    if not stamps:
+        return None
+    first, last = date.fromisoformat(stamps[0]), date.fromisoformat(stamps[-1])
+    days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+    rows = []
+    if (base / "daily.csv").exists():
+        with open(base / "daily.csv", encoding="utf-8") as f:
+            for r in csv.reader(f):
+                if r and r[0].startswith("#"):
+                    break                    # 見出し以降は日付付きの新形式（旧ロジックでは読めない）
+                if r:
+                    rows.append(r)
+    return Dataset("real log.json", id_to_name, posts, days, {}, rows or None)
+
+
+# ────────────────── 計測
+def timed(fn, repeat: int):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t)
+    return best, out
+
+
+class Report:
+    def __init__(self):
+        self.rows: list[tuple] = []
+        self.failures = 0
+
+    def add(self, dataset: str, check: str, legacy: float, fast: float, diffs: list[str]):
+        self.rows.append((dataset, check, legacy, fast, diffs))
+        if diffs:
+            self.failures += 1
+
+    def print(self):
+        print(f"{'データ':<24}{'比較':<34}{'旧(ms)':>10}{'新(ms)':>10}{'倍率':>9}  結果")
+        for dataset, check, legacy, fast, diffs in self.rows:
+            ratio = legacy / fast if fast else float("inf")
+            status = "OK" if not diffs else f"NG {len(diffs)} 件"
+            print(f"{dataset:<24}{check:<34}{legacy * 1000:>10.1f}{fast * 1000:>10.1f}{ratio:>8.1f}x  {status}")
+            for d in diffs[:5]:
+                print(f"    {d}")
+
+
+def _diff_rows(days: list[date], uids: list[str], expected: list[list[int]],
+               got: dict[str, dict[str, int]]) -> list[str]:
+    diffs = []
+    for d, row in zip(days, expected):
+        have = got.get(d.isoformat(), {})
+        want = dict(zip(uids, row))
+        if have != want:
+            bad = [u for u in uids if have.get(u) != want[u]]
+            diffs.append(f"{d}: {', '.join(f'{u[:9]} 旧={want[u]} 新={have.get(u)}' for u in bad)}")
+    return diffs
+
+
+def check(ds: Dataset, runs: int, repeat: int, report: Report):
+    uids = list(ds.id_to_name)
+    run_days = ds.days[-runs:] if runs else ds.days
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        members_path = tmp / "members.json"
+        members_path.write_text(json.dumps(ds.id_to_name, ensure_ascii=False), encoding="utf-8")
+
+        # 新形式のストア（bot.py / record.py が書いた状態を再現）
+        store_mod.LOG_PATH = tmp / "log.json"           # 初回取り込みはさせない
+        store_mod.JOURNAL_PATH = tmp / "checkins.jsonl"
+        writer = CheckinStore(tmp / "store")
+        writer.append_many([(u, ts) for u, v in ds.posts.items() for ts in v])
+        writer.checkpoint()                              # 閉じた月はセグメントへ
+        writer.close()
+
+        # ---------- daily: cron 1 回 = その日の「昨日」を 1 行
+        legacy_rows = None
+        for label, fn, logs in (("daily_check11.py", legacy_daily_11, ds.by_name_entries()),
+                                ("daily_check.py2", legacy_daily_py2, ds.by_name()),
+                                ("musclebot/daily_check.py", legacy_daily_musclebot, ds.by_uid())):
+            t_legacy, rows = timed(lambda: [fn(logs, ds.id_to_name, d) for d in run_days], repeat)
+            if legacy_rows is None:
+                legacy_rows, t_legacy_11 = rows, t_legacy
+            if rows != legacy_rows:
+                report.add(ds.label, f"{label} ⇔ daily_check11.py", t_legacy, t_legacy,
+                           _diff_rows(run_days, uids, legacy_rows, dict(
+                               (d.isoformat(), dict(zip(uids, r))) for d, r in zip(run_days, rows))))
+
+            def fast():
+                ledger_path = tmp / "daily.csv"
+                ledger_path.unlink(missing_ok=True)
+                ledger = Ledger(ledger_path, members_path)
+                for d in run_days:                       # 毎晩ストアを開き直す（daily_check.py と同じ）
+                    posted = CheckinStore(tmp / "store", readonly=True).posted_on(d)
+                    ledger.append_day(d, {u: 0 if u in posted else 1 for u in uids})
+                return {day: dict(zip(cols, values)) for day, cols, values in ledger.days()}
+
+            t_fast, got = timed(fast, repeat)
+            report.add(ds.label, f"{label} ⇔ store", t_legacy, t_fast,
+                       _diff_rows(run_days, uids, rows, got))
+
+        def rebuilt():
+            hits, _ = bucket(list(ds.by_name_entries().items()))
+            return {d.isoformat(): row for d, row in
+                    build_days(hits, ds.id_to_name, run_days[0], run_days[-1], {})}
+
+        t_fast, got = timed(rebuilt, repeat)
+        report.add(ds.label, "daily_check11.py ⇔ rebuild.py", t_legacy_11, t_fast,
+                   _diff_rows(run_days, uids, legacy_rows, got))
+
+        # ---------- monthly: 除外日（2）を足した同じ台帳で精算
+        csv_rows = []
+        statuses = []
+        for d, row in zip(run_days, legacy_rows):
+            ex = ds.exclusions.get(d.isoformat(), set())
+            row = [2 if u in ex else v for u, v in zip(uids, row)]
+            csv_rows.append([str(v) for v in row])
+            statuses.append((d, dict(zip(uids, row))))
+        ledger = Ledger(tmp / "monthly.csv", members_path)
+        ledger.extend(statuses)
+        _compare_monthly(ds.label, "monthly_report.py ⇔ settle", uids, csv_rows, ledger, repeat, report)
+
+        if ds.csv_rows is not None:                      # 実物の daily.csv のうち見出しより前の旧形式部分
+            _compare_monthly(ds.label, "daily.csv 精算 ⇔ settle", uids, ds.csv_rows,
+                             Ledger(BASE / "daily.csv", BASE / "members.json"), repeat, report,
+                             legacy_only=True)
+
+
+def _compare_monthly(label: str, check_name: str, uids: list[str], csv_rows, ledger: Ledger,
+                     repeat: int, report: Report, legacy_only: bool = False):
+    def days():
+        return (d for d in ledger.days() if d[0] is None) if legacy_only else ledger.days()
+    t_legacy, meibo = timed(lambda: legacy_monthly(csv_rows, len(uids)), repeat)
+    t_fast, (balance, _) = timed(lambda: settle(days()), repeat)
+    diffs = []
+    for u, old in zip(uids, meibo):
+        new = balance.get(u, 0)
+        if f"{old:.2f}" != f"{new:.2f}" or abs(old - new) > 1e-6:
+            diffs.append(f"{u[:9]}: 旧={old:.2f}円 新={new:.2f}円")
+    report.add(label, check_name, t_legacy, t_fast, diffs)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="旧ロジックと新経路の突き合わせ")
+    ap.add_argument("--members", type=int, default=8)
+    ap.add_argument("--days", type=int, default=365, help="合成ログの日数")
+    ap.add_argument("--runs", type=int, default=31, help="daily_check を何晩分走らせるか（0 = 全日）")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--repeat", type=int, default=3, help="計測は最速値を採用")
+    ap.add_argument("--no-real", action="store_true", help="手元の log.json を使わない")
+    args = ap.parse_args(argv)
+
+    report = Report()
+    datasets = [synthetic(args.members, args.days, args.seed)]
+    if not args.no_real and (ds := real(BASE)):
+        datasets.append(ds)
+    for ds in datasets:
+        check(ds, args.runs, args.repeat, report)
+    report.print()
+    if report.failures:
+        sys.exit(f"❌ {report.failures} 件の比較で結果が食い違いました")
+    print("✅ すべての比較で台帳と精算額が一致しました")
+
+
+if __name__ == "__main__":
+    main()
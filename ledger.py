@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+ledger.py – メンバー ID 付きの daily.csv
+────────────────────────────────────────
+形式（追記のみ。古い行は書き換えない）:
+
+    #,U111...,U222...            ← 列見出し（以降の行はこの uid 順）
+    2025-11-01,0,1               ← 日付, 各メンバーの 0/1/2
+    #,U111...,U222...,U333...    ← メンバー追加時は見出しを 1 行足すだけ
+    2025-11-02,0,0,2
+
+- 見出しより前の旧形式の行（日付なし・位置だけ）は members.json の先頭から
+  行の幅ぶんのメンバーに対応づける（メンバーは末尾に追加されるため）
+- 精算・途中経過は uid で突き合わせ、ファイルを 1 回なめるだけで計算
+- 追記は見出しの確認と書き込みを同じ flock の中で行う。最後の見出しの位置を覚えておき、
+  次からはその後ろだけ読む
+"""
+
+from __future__ import annotations
+import io, os, csv, json, fcntl, logging
+from contextlib import contextmanager
+from datetime import date
+from pathlib import Path
+from typing import Iterator
+
+BASE = Path(__file__).resolve().parent
+
+log = logging.getLogger(__name__)
+
+DAILY_CSV_PATH = BASE / "daily.csv"
+MEMBERS_PATH   = BASE / "members.json"
+
+FINE = 200          # 1 回忘れたときの罰金（円）
+HEADER = "#"
+
+
+def _roster(members_path: Path) -> list[str]:
+    try:
+        return list(json.loads(Path(members_path).read_text(encoding="utf-8")))
+    except FileNotFoundError:
+        return []
+
+
+class Ledger:
+    def __init__(self, path: Path = DAILY_CSV_PATH, members_path: Path = MEMBERS_PATH):
+        self.path         = Path(path)
+        self.members_path = Path(members_path)
+        self._head = None       # (inode, 最後の見出しの位置, その行, 読み終えた位置, 列, 記録済みの日付)
+
+    # ---------- 読み込み（ストリーミング）
+    def days(self) -> Iterator[tuple[str | None, list[str], list[int]]]:
+        """(日付 or None, uid 列, 0/1/2 列) を 1 日ずつ返す"""
+        if not self.path.exists():
+            return
+        legacy = None
+        cols = None
+        with open(self.path, encoding="utf-8", newline="") as f:
+            for i, r in enumerate(csv.reader(f), 1):
+                if not r:
+                    continue
+                if r[0] == HEADER:
+                    cols = r[1:]
+                    continue
+                try:
+                    if cols is None:            # 旧形式（位置のみ）
+                        if legacy is None:
+                            legacy = _roster(self.members_path)
+                        values = [int(v) for v in r]
+                        yield None, legacy[:len(values)], values
+                    else:
+                        values = [int(v) for v in r[1:]]
+                        yield r[0], cols[:len(values)], values
+                except ValueError:
+                    log.warning("daily.csv の行を読めません", extra={"line": i, "row": r})
+
+    def header(self) -> list[str] | None:
+        if not self.path.exists():
+            return None
+        with self._locked(fcntl.LOCK_SH) as f:
+            return self._last_header(f.fileno())
+
+    def _last_header(self, fd: int) -> list[str] | None:
+        return self._scan(fd)[0]
+
+    def _scan(self, fd: int) -> tuple[list[str] | None, set[str]]:
+        """(最後の見出し, 記録済みの日付)（flock 中に呼ぶ）。前回の見出しが同じ位置に残っていれば
+        その後ろだけ読む"""
+        st = os.fstat(fd)
+        start, found, dates = 0, None, set()
+        if self._head:
+            ino, off, raw, end, cols, seen = self._head
+            # reset() で作り直されていれば見出しの位置か中身が変わっている → 先頭から読み直す
+            if ino == st.st_ino and end <= st.st_size and os.pread(fd, len(raw), off) == raw:
+                start, found, dates = end, (off, raw, cols), seen
+        pos = start
+        for line in os.pread(fd, st.st_size - start, start).splitlines(keepends=True):
+            if line.startswith(b"#,") or line.rstrip(b"\r\n") == b"#":
+                cols = next(csv.reader([line.decode("utf-8")]))[1:]
+                found = (pos, line, cols)
+            elif found is not None:             # 見出しより後の行は先頭が日付
+                dates.add(line.split(b",", 1)[0].decode("utf-8"))
+            pos += len(line)
+        if found is None:
+            self._head = None
+            return None, set()
+        self._head = (st.st_ino, *found[:2], pos, found[2], dates)
+        return list(found[2]), dates
+
+    def version(self) -> str:
+        """追記のたびに変わる識別子（ETag 等に使う）"""
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return "0-0"
+        return f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+    # ---------- 書き込み（追記のみ）
+    @contextmanager
+    def _locked(self, mode: int = fcntl.LOCK_EX):
+        with open(self.path, "ab+") as f:
+            fcntl.flock(f, mode)
+            try:
+                yield f
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _write(f, lines: list[list]):
+        buf = io.StringIO()
+        csv.writer(buf).writerows(lines)
+        f.write(buf.getvalue().encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+
+    def _columns_for(self, f, uids: list[str]) -> tuple[list[str], bool]:
+        """uids を全部含む列順を返す。既存の見出しは並びを変えず末尾に足す（flock 中に呼ぶ）"""
+        cols = self._last_header(f.fileno())
+        if cols is None:
+            # 旧形式の行が残っていればその並びを引き継ぐ
+            cols = _roster(self.members_path) if os.fstat(f.fileno()).st_size else []
+            new_cols = cols + [u for u in uids if u not in cols]
+            return new_cols, True
+        missing = [u for u in uids if u not in cols]
+        return cols + missing, bool(missing)
+
+    def add_member(self, uid: str):
+        """新メンバーの列を追加（見出しを 1 行足すだけ）"""
+        with self._locked() as f:
+            cols, changed = self._columns_for(f, [uid])
+            if changed:
+                self._write(f, [[HEADER, *cols]])
+
+    def append_day(self, day: date, statuses: dict[str, int]) -> bool:
+        """1 日分を追記。見出しに無いメンバーは 2（除外）で埋める。記録済みの日なら書かずに False"""
+        with self._locked() as f:
+            if day.isoformat() in self._scan(f.fileno())[1]:
+                log.warning("daily.csv に記録済みの日です（追記しません）", extra={"day": day.isoformat()})
+                return False
+            cols, changed = self._columns_for(f, list(statuses))
+            lines = [[HEADER, *cols]] if changed else []
+            lines.append([day.isoformat(), *(statuses.get(u, 2) for u in cols)])
+            self._write(f, lines)
+        return True
+
+    def extend(self, days) -> int:
+        """(日付, uid -> 0/1/2) の列をまとめて追記。書いた日数を返す（記録済みの日は飛ばす）"""
+        with self._locked() as f:
+            cols, recorded = self._scan(f.fileno())
+            recorded = set(recorded)
+            lines, n = [], 0
+            for day, statuses in days:
+                if day.isoformat() in recorded:
+                    continue
+                recorded.add(day.isoformat())
+                if cols is None or any(u not in cols for u in statuses):
+                    cols = (cols or []) + [u for u in statuses if u not in (cols or [])]
+                    lines.append([HEADER, *cols])
+                lines.append([day.isoformat(), *(statuses.get(u, 2) for u in cols)])
+                n += 1
+            if lines:
+                self._write(f, lines)
+        return n
+
+    def reset(self):
+        self._head = None
+        with open(self.path, "w", encoding="utf-8", newline=""):
+            pass
+
+
+# ────────────────── 集計（1 パス）
+def settle(days) -> tuple[dict[str, float], dict[str, int]]:
+    """(uid -> 収支円, uid -> 忘れ回数)。その日の列にいない人は対象外"""
+    balance: dict[str, float] = {}
+    missed:  dict[str, int]   = {}
+    for _, cols, values in days:
+        fine_cnt    = values.count(1)
+        exclude_cnt = values.count(2)
+        payees = len(values) - fine_cnt - exclude_cnt
+        amount = FINE * fine_cnt / payees if payees > 0 else 0
+        for uid, v in zip(cols, values):
+            if v == 0:
+                balance[uid] = balance.get(uid, 0) + amount
+            elif v == 1:
+                balance[uid] = balance.get(uid, 0) - FINE
+                missed[uid] = missed.get(uid, 0) + 1
+            else:
+                balance.setdefault(uid, 0)
+    return balance, missed
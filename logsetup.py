@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+logsetup.py – 構造化ログ（キュー経由・ローテーション付き）
+────────────────────────────────────────
+- 呼び出し側は QueueHandler に積むだけ。書き込みは QueueListener のスレッドが行うので
+  リクエスト処理がログ I/O で止まらない
+- 1 行 1 JSON（ts / level / logger / msg + extra で渡した項目）
+- ファイル出力はサイズ（既定）または日付でローテーションし、古い世代は gzip 圧縮
+- DEBUG は LOG_DEBUG_SAMPLE の割合だけ出す。sampled_debug() は先に抽選するので
+  外れたときはメッセージの組み立て自体をしない
+- 複数ワーカーで動くもの（bot.py）は per_process=True で bot.<pid>.log に分けて書く。
+  同じファイルを別々の RotatingFileHandler が回すと世代がずれて行が消えるため。
+  落ちたワーカーのファイルは STALE_DAYS 日たてば次の起動時に消す
+- cron から動くスクリプトは stream=False（標準出力に出すと cron 側のリダイレクト先が
+  ローテーションされずに太る）
+- 捕まえていない例外も CRITICAL でログに残す（cron の出力を捨てても落ちたことが分かる）
+
+環境変数:
+  LOG_LEVEL         INFO（既定）/ DEBUG ...
+  LOG_DIR           ファイルの出力先（既定 logs/）
+  LOG_ROTATE        size（既定）/ time（毎日 0 時）
+  LOG_MAX_BYTES     size ローテーションの上限（既定 1MB）
+  LOG_BACKUPS       残す世代数（既定 7）
+  LOG_DEBUG_SAMPLE  DEBUG を出す割合（既定 0.01）
+"""
+
+from __future__ import annotations
+import os, sys, gzip, json, time, queue, random, atexit, shutil, logging
+import logging.handlers
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent
+
+LOG_LEVEL    = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_DIR      = Path(os.getenv("LOG_DIR", BASE / "logs"))
+LOG_ROTATE   = os.getenv("LOG_ROTATE", "size")
+LOG_MAX      = int(os.getenv("LOG_MAX_BYTES", str(1 << 20)))
+LOG_BACKUPS  = int(os.getenv("LOG_BACKUPS", "7"))
+DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", "0.01"))
+STALE_DAYS   = 7
+
+JST = timezone(timedelta(hours=9))
+
+# LogRecord が元から持っている属性（extra 以外）
+_STD = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, JST).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k, v in record.__dict__.items():
+            if k not in _STD and not k.startswith("_"):
+                out[k] = v
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class SampledDebugFilter(logging.Filter):
+    """DEBUG は rate の割合だけ通す（INFO 以上は全部）"""
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or getattr(record, "_sampled", False):
+            return True
+        return random.random() < self.rate
+
+
+def debug_sampled(logger: logging.Logger, rate: float = DEBUG_SAMPLE) -> bool:
+    """DEBUG を出すべきときだけ True（無効時は isEnabledFor 1 回で終わる）"""
+    return logger.isEnabledFor(logging.DEBUG) and random.random() < rate
+
+
+def sampled_debug(logger: logging.Logger, msg: str, fields=None):
+    """抽選に当たったときだけ DEBUG を出す。fields は dict を返す関数でもよい"""
+    if debug_sampled(logger):
+        extra = fields() if callable(fields) else dict(fields or {})
+        extra["_sampled"] = True           # フィルタで二重に間引かない
+        logger.debug(msg, extra=extra)
+
+
+def _gzip_rotator(source: str, dest: str):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _prune_stale(stem: str):
+    """落ちたワーカーの <stem>.<pid>.log*（世代も含む）を STALE_DAYS 日で消す"""
+    limit = time.time() - STALE_DAYS * 86400
+    for p in LOG_DIR.glob(f"{stem}.*.log*"):
+        pid = p.name[len(stem) + 1:].split(".", 1)[0]
+        try:
+            if pid.isdigit() and not _alive(int(pid)) and p.stat().st_mtime < limit:
+                p.unlink()
+        except OSError:
+            pass
+
+
+def _file_handler(filename: str, per_process: bool = False) -> logging.Handler:
+    LOG_DIR.mkdir(exist_ok=True)
+    if per_process:
+        stem, _, ext = filename.rpartition(".")
+        _prune_stale(stem)
+        filename = f"{stem}.{os.getpid()}.{ext}"
+    path = LOG_DIR / filename
+    if LOG_ROTATE == "time":
+        h = logging.handlers.TimedRotatingFileHandler(
+            path, when="midnight", backupCount=LOG_BACKUPS, encoding="utf-8")
+    else:
+        h = logging.handlers.RotatingFileHandler(
+            path, maxBytes=LOG_MAX, backupCount=LOG_BACKUPS, encoding="utf-8")
+    h.namer   = lambda name: name + ".gz"
+    h.rotator = _gzip_rotator
+    return h
+
+
+def setup_logging(filename: str | None = None, stream: bool = True,
+                  per_process: bool = False) -> logging.Logger:
+    """ルートロガーを QueueHandler 1 本にする。何度呼んでも 1 回だけ有効
+    （per_process はワーカーの中で呼ぶこと。fork 前に呼ぶと親の pid になる）"""
+    global _listener
+    root = logging.getLogger()
+    if _listener is not None:
+        return root
+
+    formatter = JsonFormatter()
+    handlers = []
+    if stream:
+        handlers.append(logging.StreamHandler())
+    if filename:
+        handlers.append(_file_handler(filename, per_process))
+    for h in handlers:
+        h.setFormatter(formatter)
+
+    q: queue.Queue = queue.Queue(-1)
+    qh = logging.handlers.QueueHandler(q)
+    qh.addFilter(SampledDebugFilter(DEBUG_SAMPLE))
+    root.handlers[:] = [qh]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)       # 終了時にキューを吐き出す（excepthook の後に走る）
+    _install_excepthook()
+    return root
+
+
+def _install_excepthook():
+    previous = sys.excepthook
+
+    def hook(exc_type, exc, tb):
+        if not issubclass(exc_type, KeyboardInterrupt):
+            logging.getLogger("uncaught").critical(
+                "捕まえていない例外で終了", exc_info=(exc_type, exc, tb))
+        previous(exc_type, exc, tb)       # stderr にも従来どおり出す
+    sys.excepthook = hook
@@ -1,137 +1,62 @@
-import csv
-import os
-import json
-<<<<<<< HEAD
-from datetime import datetime
-from dotenv import load_dotenv
-from linebot import LineBotApi
-from linebot.models import TextSendMessage
-
-=======
-from datetime import datetime, timedelta
-from dotenv import load_dotenv
-from pathlib import Path
-from linebot import LineBotApi
-from linebot.models import TextSendMessage
-
-BASE = Path(__file__).resolve().parent
->>>>>>> ローカルの変更を保存
-load_dotenv()
-
-line_bot_api = LineBotApi(os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
-group_id = os.getenv("LINE_GROUP_ID")
-
-<<<<<<< HEAD
-#  実行モード判定（自動実行か手動か）
-auto_mode = os.getenv("AUTO_MONTHLY") == "1"
-
-#  メンバー情報を取得（順序保持）
-with open("members.json", "r", encoding="utf-8") as f:
-=======
-auto_mode = os.getenv("AUTO_MONTHLY") == "1"
-
-with open(BASE / "members.json", "r", encoding="utf-8") as f:
->>>>>>> ローカルの変更を保存
-    id_to_name = json.load(f)
-
-user_ids = list(id_to_name.keys())
-member_names = [id_to_name[uid] for uid in user_ids]
-N = len(user_ids)
-
-<<<<<<< HEAD
-#  daily.csv を読み込み
-with open("daily.csv", "r", encoding="utf-8") as f:
-    rows = list(csv.reader(f))
-
-days = len(rows)
-meibo = [0] * N  # 各人の罰金記録
-
-#  日毎に計算
-=======
-with open(BASE / "daily.csv", "r", encoding="utf-8") as f:
-    rows = list(csv.reader(f))
-
-days = len(rows)
-meibo = [0] * N
-
->>>>>>> ローカルの変更を保存
-for i, day in enumerate(rows, 1):
-    if len(day) != N:
-        print(f"️ スキップ: day {i} の列数が不一致（{len(day)}列、想定は {N}列）")
-        continue
-
-<<<<<<< HEAD
-    # 罰金人数と除外人数をカウント
-    fine_cnt     = sum(1 for v in day if int(v) == 1)
-    exclude_cnt  = sum(1 for v in day if int(v) == 2)
-
-    # 配当額（受け取る金額／人）
-=======
-    fine_cnt = sum(1 for v in day if int(v) == 1)
-    exclude_cnt = sum(1 for v in day if int(v) == 2)
-
->>>>>>> ローカルの変更を保存
-    if (N - fine_cnt - exclude_cnt) > 0:
-        amount = 200 * fine_cnt / (N - fine_cnt - exclude_cnt)
-    else:
-        amount = 0
-
-<<<<<<< HEAD
-    # メンバー別累計
-    for j, v in enumerate(map(int, day)):
-        if v == 0:
-            meibo[j] += amount         # 配当を受け取る
-        elif v == 1:
-            meibo[j] -= 200            # 罰金を払う
-        # v == 2 のときは何もしない
-
-#  結果テキスト整形
-lines = [f"{member_names[i]}: {meibo[i]:.2f}円" for i in range(N)]
-
-if auto_mode:
-    from datetime import timedelta
-    last_month_date = datetime.now().replace(day=1) - timedelta(days=1)
-    month_title = last_month_date.strftime("%-m月総計")  # 前月
-=======
-    for j, v in enumerate(map(int, day)):
-        if v == 0:
-            meibo[j] += amount
-        elif v == 1:
-            meibo[j] -= 200
-
-lines = [f"{member_names[i]}: {meibo[i]:.2f}円" for i in range(N)]
-
-if auto_mode:
-    last_month_date = datetime.now().replace(day=1) - timedelta(days=1)
-    month_title = last_month_date.strftime("%-m月総計")
->>>>>>> ローカルの変更を保存
-    result_text = month_title + "\n" + "\n".join(lines)
-else:
-    result_text = "\n".join(lines)
-
-<<<<<<< HEAD
-
-#  送信
-=======
->>>>>>> ローカルの変更を保存
-print(f" 送信先: {group_id}")
-print(" 送信内容:")
-print(result_text)
-
-try:
-    line_bot_api.push_message(group_id, TextSendMessage(text=result_text))
-    print(" 罰金結果をLINEに送信しました")
-except Exception as e:
-    print("❌ LINEへの送信に失敗しました:", e)
-
-<<<<<<< HEAD
-#  自動実行時は daily.csv を初期化
-if auto_mode:
-    with open("daily.csv", "w", encoding="utf-8", newline='') as f:
-        pass  # 空で初期化
-=======
-if auto_mode:
-    with open(BASE / "daily.csv", "w", encoding="utf-8", newline='') as f:
-        pass
->>>>>>> ローカルの変更を保存
-    print("️ 自動実行モード：daily.csv を初期化しました")
+import os
+import json
+import logging
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from pathlib import Path
+from linebot import LineBotApi
+
+from dispatcher import Dispatcher
+from ledger import Ledger, settle
+from logsetup import setup_logging
+from profiling import profile_script
+
+BASE = Path(__file__).resolve().parent
+load_dotenv()
+setup_logging("monthly_report.log", stream=False)
+log = logging.getLogger("monthly_report")
+profile_script("monthly_report")       # PROFILE_RATE=1 で計測
+
+line_bot_api = LineBotApi(os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
+dispatcher = Dispatcher(line_bot_api)
+group_id = os.getenv("LINE_GROUP_ID")
+
+auto_mode = os.getenv("AUTO_MONTHLY") == "1"
+
+with open(BASE / "members.json", "r", encoding="utf-8") as f:
+    id_to_name = json.load(f)
+
+user_ids = list(id_to_name.keys())
+
+# uid で突き合わせるので、月の途中でメンバーが増えても前半の日は捨てない
+ledger = Ledger(BASE / "daily.csv", BASE / "members.json")
+meibo, _ = settle(ledger.days())
+
+# 退会済みでも今月の記録があれば表示
+user_ids += [uid for uid in meibo if uid not in id_to_name]
+
+lines = [f"{id_to_name.get(uid, uid)}: {meibo.get(uid, 0):.2f}円" for uid in user_ids]
+
+if auto_mode:
+    last_month_date = datetime.now().replace(day=1) - timedelta(days=1)
+    month_title = last_month_date.strftime("%-m月総計")
+    result_text = month_title + "\n" + "\n".join(lines)
+else:
+    result_text = "\n".join(lines)
+
+log.info("月報送信", extra={"to": group_id, "text": result_text})
+
+# outbox に書き出してから送信するので、ここで失敗しても結果は残る
+if dispatcher.push(group_id, result_text):
+    log.info("罰金結果をLINEに送信しました")
+else:
+    left = dispatcher.flush(wait=True, timeout=120)
+    if left:
+        log.error("LINEへの送信に失敗しました（dispatcher.py で再送）", extra={"left": left})
+    else:
+        log.info("罰金結果をLINEに送信しました（再送）")
+
+# 結果は outbox に永続化済みなので、送信失敗でも初期化してよい
+if auto_mode:
+    ledger.reset()
+    log.info("自動実行モード：daily.csv を初期化しました")
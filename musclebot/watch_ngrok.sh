@@ -21,7 +21,7 @@
 set -euo pipefail
 
 # ───────── 設定 ─────────
-PORT=5000                           # Flask / record.py が listen しているポート
+PORT=5000                           # record.py が listen しているポート
 SESSION_NAME="ngrok"                # tmux セッション名
 API_URL="http://127.0.0.1:4040/api/tunnels"
 URL_FILE="$(dirname "$0")/current_ngrok_url.txt"
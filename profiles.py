@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+profiles.py – 未登録 uid のプロフィール解決 & メンバー自動登録
+────────────────────────────────────────
+- グループメンバープロフィール API の結果を TTL + LRU でキャッシュ
+- 同じ uid の同時問い合わせは 1 回の API 呼び出しにまとめる（single-flight）
+- 新メンバーは members.json の末尾に追加し、daily.csv には列見出しを 1 行足す
+- 共有インデックス（shared_index.py）があれば名簿はそこから読む。ワーカーごとの
+  members.json の stat / 再読込は MEMBERS_POLL 秒に 1 回（手編集の反映用）だけ
+"""
+
+from __future__ import annotations
+import os, json, time, fcntl, threading, logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+from store import write_atomic
+
+BASE = Path(__file__).resolve().parent
+
+log = logging.getLogger(__name__)
+
+MEMBERS_PATH   = BASE / "members.json"
+LOCK_PATH      = BASE / ".members.lock"
+
+PROFILE_TTL    = float(os.getenv("PROFILE_TTL", "3600"))
+NEGATIVE_TTL   = float(os.getenv("PROFILE_NEGATIVE_TTL", "600"))
+PROFILE_MAX    = int(os.getenv("PROFILE_CACHE_SIZE", "256"))
+MEMBERS_POLL   = float(os.getenv("MEMBERS_POLL", "5"))
+
+_MISSING = object()
+
+
+# ────────────────── TTL / LRU キャッシュ + single-flight
+class ProfileCache:
+    def __init__(self, fetch, ttl: float = PROFILE_TTL,
+                 negative_ttl: float = NEGATIVE_TTL, maxsize: int = PROFILE_MAX):
+        self.fetch        = fetch          # key -> 値（失敗時は例外）
+        self.ttl          = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize      = maxsize
+        self.entries: OrderedDict = OrderedDict()   # key -> (期限, 値)
+        self.inflight: dict = {}                    # key -> [Event, 値]
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def _lookup(self, key):
+        hit = self.entries.get(key)
+        if hit is None:
+            return _MISSING
+        expires, value = hit
+        if expires < time.monotonic():
+            del self.entries[key]
+            return _MISSING
+        self.entries.move_to_end(key)
+        return value
+
+    def get(self, key):
+        """値を返す。取得失敗は None（negative_ttl の間は再問い合わせしない）"""
+        with self.lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                return value
+            slot = self.inflight.get(key)
+            leader = slot is None
+            if leader:
+                slot = self.inflight[key] = [threading.Event(), None]
+
+        if not leader:
+            slot[0].wait()
+            return slot[1]
+
+        try:
+            self.calls += 1
+            value, ttl = self.fetch(key), self.ttl
+        except Exception as e:
+            log.warning("プロフィール取得失敗", extra={"key": key, "error": str(e)})
+            value, ttl = None, self.negative_ttl
+
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            slot[1] = value
+            del self.inflight[key]
+        slot[0].set()
+        return value
+
+
+# ────────────────── members.json
+@contextmanager
+def _locked():
+    with open(LOCK_PATH, "a") as lk:
+        fcntl.flock(lk, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lk, fcntl.LOCK_UN)
+
+
+class MemberRegistry:
+    """uid → 名前。members.json は mtime が変わった時だけ読み直す"""
+
+    def __init__(self, api, group_id: str, ledger, members_path: Path = MEMBERS_PATH,
+                 index=None):
+        self.members_path = Path(members_path)
+        self.ledger       = ledger
+        self.group_id     = group_id
+        self.index        = index
+        self.profiles     = ProfileCache(
+            lambda uid: api.get_group_member_profile(group_id, uid).display_name)
+        self._members: dict[str, str] = {}
+        self._mtime = None
+        self._gen   = None
+        self._next_poll = 0.0
+        self.lock = threading.Lock()
+
+    def members(self) -> dict[str, str]:
+        if self.index is not None:
+            return self._shared_members()
+        try:
+            mtime = self.members_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        with self.lock:
+            if mtime != self._mtime:
+                try:
+                    self._members = json.loads(self.members_path.read_text(encoding="utf-8"))
+                    self._mtime = mtime
+                except Exception as e:
+                    log.warning("members.json 読込失敗", extra={"error": str(e)})
+            return self._members
+
+    def _shared_members(self) -> dict[str, str]:
+        now = time.monotonic()
+        if now >= self._next_poll:
+            self._next_poll = now + MEMBERS_POLL
+            self._publish()
+        gen = (self.index.epoch(), self.index.member_gen())   # 作り直されると版は 0 に戻る
+        if gen != self._gen:
+            members = self.index.members()
+            if members is None:                  # 書き手が途中で落ちた → ファイルから
+                self._publish(force=True)
+                members = self.index.members() or {}
+            with self.lock:
+                self._members, self._gen = members, gen
+        return self._members
+
+    def version(self) -> str:
+        """members() が返している名簿の版（ETag 用）。ファイルの mtime ではなく実際に読んだものの版"""
+        self.members()
+        return f"{self._gen[0]:x}.{self._gen[1]:x}" if self.index is not None else f"{self._mtime or 0:x}"
+
+    def _publish(self, force: bool = False):
+        """members.json が共有インデックスより新しければ載せ直す"""
+        try:
+            mtime = self.members_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if not force and mtime == self.index.members_mtime():
+            return
+        with _locked():
+            try:
+                members = json.loads(self.members_path.read_text(encoding="utf-8"))
+            except Exception as e:
+                log.warning("members.json 読込失敗", extra={"error": str(e)})
+                return
+            self.index.set_members(members, self.members_path.stat().st_mtime_ns)
+
+    def name_for(self, uid: str) -> str:
+        """登録済みならその名前。未登録ならプロフィールを引いて自動登録"""
+        name = self.members().get(uid)
+        if name:
+            return name
+        display = self.profiles.get(uid)
+        if not display:
+            return uid          # 取得できなければ従来どおり uid で記録
+        return self.register(uid, display)
+
+    def register(self, uid: str, display: str) -> str:
+        with _locked():
+            members = {}
+            if self.members_path.exists():
+                members = json.loads(self.members_path.read_text(encoding="utf-8"))
+            if uid in members:         # 他ワーカーが先に登録済み
+                return members[uid]
+
+            # 表示名の重複は末尾に uid の一部を付けて区別
+            name = display
+            if name in members.values():
+                name = f"{display}_{uid[-4:]}"
+            members[uid] = name
+            write_atomic(self.members_path,
+                         json.dumps(members, ensure_ascii=False, indent=2) + "\n")
+            self.ledger.add_member(uid)
+            if self.index is not None:           # 他ワーカーにも即座に見せる
+                self.index.set_members(members, self.members_path.stat().st_mtime_ns)
+        log.info("メンバー自動登録", extra={"uid": uid, "member": name})
+        return name
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+profiling.py – 必要なときだけ使うサンプリングプロファイラ
+────────────────────────────────────────
+環境変数:
+  PROFILE_RATE         プロファイルするリクエストの割合（0〜1、既定 0 = 無効）
+  PROFILE_MODE         sample（既定: スタックを定期採取して collapsed 形式）/ cprofile（pstats）
+  PROFILE_INTERVAL_MS  sample モードの採取間隔（既定 5ms）
+  PROFILE_DIR          出力先（既定 profiles/）
+  PROFILE_TOKEN        /debug/profile を使うためのトークン（未設定なら無効）
+
+- 無効時は profile() が共有の nullcontext を返すだけ
+- sample モードは 1 本のスレッドが対象スレッドのスタックだけを採取して集計する
+- 出力: profiles/<名前>-<pid>.collapsed（flamegraph.pl / speedscope で読める）
+        profiles/<名前>-<pid>.pstats（cprofile モード）
+"""
+
+from __future__ import annotations
+import os, sys, hmac, time, atexit, random, threading, logging
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent
+
+log = logging.getLogger(__name__)
+
+PROFILE_RATE     = float(os.getenv("PROFILE_RATE", "0") or 0)
+PROFILE_MODE     = os.getenv("PROFILE_MODE", "sample")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_DIR      = Path(os.getenv("PROFILE_DIR", BASE / "profiles"))
+PROFILE_TOKEN    = os.getenv("PROFILE_TOKEN", "")
+
+MAX_DEPTH = 64
+_OFF = nullcontext()
+
+
+def _collapse(frame) -> str:
+    parts = []
+    while frame is not None and len(parts) < MAX_DEPTH:
+        code = frame.f_code
+        parts.append(f"{Path(code.co_filename).name}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class Profiler:
+    def __init__(self, rate: float = PROFILE_RATE, mode: str = PROFILE_MODE,
+                 interval: float = PROFILE_INTERVAL, out_dir: Path = PROFILE_DIR):
+        self.rate     = max(0.0, min(1.0, rate))
+        self.mode     = mode
+        self.interval = interval
+        self.out_dir  = Path(out_dir)
+        self.lock     = threading.Lock()
+        self.samples: dict[str, Counter] = {}   # 名前 → collapsed スタック → 回数
+        self.stats: dict = {}                   # 名前 → pstats.Stats
+        self.counts: Counter = Counter()        # 名前 → プロファイルした回数
+        self.active: dict[int, str] = {}        # スレッド ident → 名前
+        self.wake     = threading.Event()
+        self.sampler  = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    # ---------- 入口
+    def profile(self, name: str, force: bool = False):
+        """with profiler.profile("callback"): ... 。対象外なら何もしない"""
+        if not self.enabled or (not force and random.random() >= self.rate):
+            return _OFF
+        return self._session(name)
+
+    @contextmanager
+    def _session(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+        if self.mode == "cprofile":
+            import cProfile, pstats
+            prof = cProfile.Profile()
+            prof.enable()
+            try:
+                yield
+            finally:
+                prof.disable()
+                with self.lock:
+                    if name in self.stats:
+                        self.stats[name].add(prof)
+                    else:
+                        self.stats[name] = pstats.Stats(prof)
+            return
+
+        ident = threading.get_ident()
+        with self.lock:
+            self.active[ident] = name
+            self._ensure_sampler()
+        self.wake.set()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active.pop(ident, None)
+                if not self.active:
+                    self.wake.clear()
+
+    # ---------- 採取スレッド
+    def _ensure_sampler(self):
+        if self.sampler is None or not self.sampler.is_alive():
+            self.sampler = threading.Thread(target=self._sample_loop,
+                                            name="profiler", daemon=True)
+            self.sampler.start()
+
+    def _sample_loop(self):
+        while True:
+            self.wake.wait()
+            with self.lock:
+                targets = dict(self.active)
+            if targets:
+                frames = sys._current_frames()
+                with self.lock:
+                    for ident, name in targets.items():
+                        frame = frames.get(ident)
+                        if frame is not None:
+                            self.samples.setdefault(name, Counter())[_collapse(frame)] += 1
+            time.sleep(self.interval)
+
+    # ---------- 出力
+    def collapsed(self) -> str:
+        with self.lock:
+            return "".join(f"{name};{stack} {n}\n"
+                           for name, counter in self.samples.items()
+                           for stack, n in counter.most_common())
+
+    def dump(self) -> list[Path]:
+        """集計結果をファイルに書き出す（上書き）"""
+        self.out_dir.mkdir(exist_ok=True)
+        os.chmod(self.out_dir, 0o700)
+        pid, paths = os.getpid(), []
+        with self.lock:
+            for name, counter in self.samples.items():
+                path = self.out_dir / f"{name}-{pid}.collapsed"
+                path.write_text("".join(f"{stack} {n}\n" for stack, n in counter.most_common()),
+                                encoding="utf-8")
+                paths.append(path)
+            for name, st in self.stats.items():
+                path = self.out_dir / f"{name}-{pid}.pstats"
+                st.dump_stats(path)
+                paths.append(path)
+        return paths
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {"rate": self.rate, "mode": self.mode,
+                    "profiled": dict(self.counts),
+                    "samples": {k: sum(c.values()) for k, c in self.samples.items()}}
+
+
+profiler = Profiler()
+
+
+def profile_script(name: str):
+    """バッチ用: 採用されたらプロセス終了時まで計測して書き出す"""
+    ctx = profiler.profile(name)
+    if ctx is _OFF:
+        return
+    ctx.__enter__()
+
+    def _finish():
+        ctx.__exit__(None, None, None)
+        for p in profiler.dump():
+            log.info("profile 書き出し", extra={"file": str(p)})
+    atexit.register(_finish)
+
+
+def authorized(token: str | None) -> bool:
+    # str 同士だと非 ASCII が来たとき TypeError になるのでバイト列で比べる
+    return bool(PROFILE_TOKEN) and hmac.compare_digest((token or "").encode("utf-8"),
+                                                       PROFILE_TOKEN.encode("utf-8"))
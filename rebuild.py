@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+rebuild.py – 投稿ログから daily.csv を作り直す
+────────────────────────────────────────
+- 既定は store/（スナップショット + WAL）。閉じた月のセグメントは期間にかかる分だけ読む。--log を指定すると
+  log.json（bot.py 形式: 名前 → [{"date", "ts"}]、旧 record.py 形式: uid → ["ts"]）や
+  record.py の checkins.jsonl を 1 回だけなめて (JST 日付, uid) の集合に振り分ける
+- タイムゾーン無しの ts は JST とみなす。時刻として読めない ts は数えない
+- --workers で大きなログをチャンクに分けて複数プロセスで処理
+- exclusions.json（{"2025-11-05": ["uid または 名前", ...]}、"*" は全員）で 2 を付ける
+
+例:
+    python rebuild.py --month 2025-11 --out daily.csv          # store/ から
+    python rebuild.py --start 2024-01-01 --end 2025-12-31 --log log.json --log checkins.jsonl
+"""
+
+from __future__ import annotations
+import sys, json, argparse
+from datetime import date, datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from ledger import Ledger
+from store import CheckinStore
+
+BASE = Path(__file__).resolve().parent
+
+MEMBERS_PATH    = BASE / "members.json"
+EXCLUSIONS_PATH = BASE / "exclusions.json"
+
+JST = timezone(timedelta(hours=9))
+
+
+# ────────────────── 日付への振り分け
+def jst_day(ts: str) -> str | None:
+    """ISO 文字列 → JST の 'YYYY-MM-DD'（旧 daily_check と同じく読めない ts は None）"""
+    # 先頭 10 文字だけで決めると '2025-11-02T25:00:00' まで投稿扱いになる（equivalence.py で検出）
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        return dt.date().isoformat()
+    return dt.astimezone(JST).date().isoformat()
+
+
+def _entry_ts(entry) -> str | None:
+    if isinstance(entry, str):
+        return entry
+    if isinstance(entry, dict):
+        return entry.get("ts") or entry.get("date")
+    return None
+
+
+def bucket(chunk: list[tuple[str, list]]) -> tuple[set[tuple[str, str]], int]:
+    """[(キー, エントリ列)] → ({(日付, キー)}, 読めなかった件数)"""
+    hits, bad = set(), 0
+    for key, entries in chunk:
+        for entry in entries:
+            ts = _entry_ts(entry)
+            day = jst_day(ts) if isinstance(ts, str) else None
+            if day is None:
+                bad += 1
+            else:
+                hits.add((day, key))
+    return hits, bad
+
+
+def _chunks(items: list, n: int) -> list[list]:
+    """エントリ数がだいたい均等になるように n 分割"""
+    total = sum(len(v) for _, v in items) or 1
+    size = total / n
+    out, cur, acc = [], [], 0
+    for item in items:
+        cur.append(item)
+        acc += len(item[1])
+        if acc >= size and len(out) < n - 1:
+            out.append(cur)
+            cur, acc = [], 0
+    out.append(cur)
+    return out
+
+
+def collect(log_paths: list[Path] | None, workers: int = 1,
+            start: date | None = None, end: date | None = None) -> tuple[set[tuple[str, str]], int]:
+    if not log_paths:
+        return CheckinStore(readonly=True).hits(start, end), 0    # 日番号で集計済み
+    items = []
+    for p in log_paths:
+        if Path(p).suffix == ".jsonl":      # record.py の checkins.jsonl
+            by_uid: dict[str, list] = {}
+            with open(p, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                        by_uid.setdefault(rec["uid"], []).append(rec["ts"])
+                    except (ValueError, KeyError):
+                        by_uid.setdefault("", []).append(None)   # 件数だけ数える
+            items += by_uid.items()
+            continue
+        logs = json.loads(Path(p).read_text(encoding="utf-8"))
+        items += [(k, v) for k, v in logs.items() if isinstance(v, list)]
+    if workers <= 1:
+        return bucket(items)
+    hits, bad = set(), 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for h, b in pool.map(bucket, _chunks(items, workers)):
+            hits |= h
+            bad += b
+    return hits, bad
+
+
+# ────────────────── 台帳の生成
+def load_exclusions(path: Path) -> dict[str, set[str]]:
+    if not Path(path).exists():
+        return {}
+    raw = json.loads(Path(path).read_text(encoding="utf-8"))
+    return {day: set(keys) for day, keys in raw.items()}
+
+
+def build_days(hits: set[tuple[str, str]], id_to_name: dict[str, str],
+               start: date, end: date, exclusions: dict[str, set[str]]):
+    """(日付, uid → 0/1/2) を日付順に返す"""
+    # ログのキーは uid（record.py）でも名前（bot.py）でもよい
+    posted: dict[str, set[str]] = {}
+    name_to_id = {n: u for u, n in id_to_name.items()}
+    for day, key in hits:
+        uid = key if key in id_to_name else name_to_id.get(key)
+        if uid is not None:
+            posted.setdefault(day, set()).add(uid)
+
+    d = start
+    while d <= end:
+        key = d.isoformat()
+        done = posted.get(key, ())
+        ex = exclusions.get(key, set())
+        row = {}
+        for uid, name in id_to_name.items():
+            if "*" in ex or uid in ex or name in ex:
+                row[uid] = 2
+            else:
+                row[uid] = 0 if uid in done else 1
+        yield d, row
+        d += timedelta(days=1)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="投稿ログから daily.csv を再生成")
+    ap.add_argument("--log", action="append", type=Path, help="log.json（複数可）")
+    ap.add_argument("--members", type=Path, default=MEMBERS_PATH)
+    ap.add_argument("--exclusions", type=Path, default=EXCLUSIONS_PATH)
+    ap.add_argument("--month", help="YYYY-MM（--start/--end の代わり）")
+    ap.add_argument("--start", type=date.fromisoformat)
+    ap.add_argument("--end", type=date.fromisoformat)
+    ap.add_argument("--out", type=Path, default=BASE / "daily.rebuilt.csv")
+    ap.add_argument("--workers", type=int, default=1)
+    args = ap.parse_args(argv)
+
+    id_to_name = json.loads(args.members.read_text(encoding="utf-8"))
+    yesterday = datetime.now(JST).date() - timedelta(days=1)
+    if args.month:
+        start = date.fromisoformat(args.month + "-01")
+        nxt = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        end = min(nxt - timedelta(days=1), yesterday)
+        hits, bad = collect(args.log, args.workers, start, end)
+    else:
+        hits, bad = collect(args.log, args.workers, args.start, args.end)
+        days = sorted(d for d, _ in hits)
+        start = args.start or (date.fromisoformat(days[0]) if days else yesterday)
+        end = args.end or yesterday
+    if bad:
+        print(f"⚠️ 日付を読めないエントリ: {bad} 件")
+    if start > end:
+        sys.exit(f"❌ 期間が空です: {start} 〜 {end}")
+
+    ledger = Ledger(args.out, args.members)
+    ledger.reset()
+    n = ledger.extend(build_days(hits, id_to_name, start, end,
+                                 load_exclusions(args.exclusions)))
+    print(f"✅ {start} 〜 {end} の {n} 日分を {args.out} に書き出しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+record.py – 大学サーバー側の投稿受付（asyncio）
+────────────────────────────────────────
+- POST /record        {"user_id": "...", "ts": "ISO8601"}            1 件
+- POST /record/batch  {"events": [{"user_id": "...", "ts": "..."}]}  複数件
+- ts は投稿時刻をそのまま保存（無ければ受信時刻を JST で付ける）
+- 同時に届いた投稿はまとめて 1 回の write + fsync で store/ の WAL に追記
+  （group commit）。応答は fsync 完了後に返す
+
+起動:
+    python record.py            # 0.0.0.0:5000
+"""
+
+from __future__ import annotations
+import os, json, asyncio, logging
+from datetime import datetime, timezone, timedelta
+
+from logsetup import setup_logging
+from store import CheckinStore, valid_uid
+
+log = logging.getLogger(__name__)
+
+HOST = os.getenv("RECORD_HOST", "0.0.0.0")
+PORT = int(os.getenv("RECORD_PORT", "5000"))
+
+COMMIT_WINDOW = float(os.getenv("RECORD_COMMIT_WINDOW_MS", "2")) / 1000  # まとめ待ちの上限
+MAX_BODY      = 1 << 20
+MAX_BATCH     = 1000
+
+JST = timezone(timedelta(hours=9))
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           411: "Length Required", 413: "Payload Too Large", 417: "Expectation Failed",
+           500: "Internal Server Error"}
+ERRORS  = {411: "content-length required", 413: "too large", 417: "expectation failed"}
+
+
+# ────────────────── 入力チェック
+def normalize(event: dict, received: str) -> dict | None:
+    """{"uid", "ts"} に揃える。不正なら None"""
+    if not isinstance(event, dict):
+        return None
+    uid = event.get("user_id") or event.get("uid")
+    if not valid_uid(uid):                      # 長すぎる / タブ入りは WAL に載せない
+        return None
+    ts = event.get("ts") or event.get("timestamp")
+    if ts is None and event.get("date"):
+        ts = event["date"]                      # 旧 bot.py は日付だけ送ってくる
+    if ts is None:
+        ts = received
+    try:
+        datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return {"uid": uid, "ts": str(ts)}
+
+
+# ────────────────── group commit
+class GroupCommitter:
+    def __init__(self, store: CheckinStore, window: float = COMMIT_WINDOW):
+        self.store  = store
+        self.window = window
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.commits = 0
+        self.records = 0
+        self.task: asyncio.Task | None = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def submit(self, records: list[dict]):
+        """records が fsync されるまで待つ"""
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((records, fut))
+        await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            if self.window:
+                await asyncio.sleep(self.window)     # 同時到着をもう少し拾う
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            rows = [(r["uid"], r["ts"]) for records, _ in batch for r in records]
+            try:
+                await loop.run_in_executor(None, self.store.append_many, rows)
+            except Exception as e:
+                log.error("WAL 書込失敗", extra={"error": str(e)})
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            self.commits += 1
+            self.records += sum(len(records) for records, _ in batch)
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_result(None)
+
+
+# ────────────────── HTTP
+async def _read_request(reader, writer):
+    """(method, path, headers, body)。本文を読まずに断るときは body に状態コードを入れる"""
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        h = await reader.readline()
+        if h in (b"\r\n", b"\n", b""):
+            break
+        k, _, v = h.decode("latin-1").partition(":")
+        headers[k.strip().lower()] = v.strip()
+    if "transfer-encoding" in headers:          # chunked は読まない（本文の切れ目が分からなくなる）
+        return method, path, headers, 411
+    length = int(headers.get("content-length", "0") or 0)
+    if length > MAX_BODY:
+        return method, path, headers, 413
+    expect = headers.get("expect", "").lower()
+    if expect:
+        if expect != "100-continue":
+            return method, path, headers, 417
+        if length:                              # curl などは 100 を待ってから本文を送る
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def _response(status: int, payload, keep_alive: bool) -> bytes:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+async def route(committer: GroupCommitter, method: str, path: str, body: bytes):
+    path = path.split("?", 1)[0]
+    if path == "/" and method == "GET":
+        return 200, {"status": "alive", "commits": committer.commits,
+                     "records": committer.records}
+    if path not in ("/record", "/record/batch"):
+        return 404, {"error": "not found"}
+    if method != "POST":
+        return 405, {"error": "method not allowed"}
+    try:
+        data = json.loads(body or b"null")
+    except ValueError:
+        return 400, {"error": "invalid json"}
+
+    if path == "/record":
+        events = [data]
+    else:
+        events = data.get("events") if isinstance(data, dict) else data
+        if not isinstance(events, list) or len(events) > MAX_BATCH:
+            return 400, {"error": "invalid batch"}
+
+    received = datetime.now(JST).isoformat()
+    records = [normalize(e, received) for e in events]
+    if not records or any(r is None for r in records):
+        return 400, {"error": "invalid data"}
+    await committer.submit(records)
+    return 200, {"status": "ok", "count": len(records)}
+
+
+async def handle(committer: GroupCommitter, reader, writer):
+    try:
+        while True:
+            try:
+                req = await _read_request(reader, writer)
+            except (asyncio.IncompleteReadError, ValueError):
+                break
+            if req is None:
+                break
+            method, path, headers, body = req
+            keep_alive = headers.get("connection", "").lower() != "close"
+            if isinstance(body, int):               # 本文を読んでいないので接続ごと閉じる
+                status, payload, keep_alive = body, {"error": ERRORS[body]}, False
+            else:
+                try:
+                    status, payload = await route(committer, method, path, body)
+                except Exception:
+                    log.exception("/record 処理失敗")
+                    status, payload = 500, {"error": "internal error"}
+            writer.write(_response(status, payload, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def main(host: str = HOST, port: int = PORT):
+    store = CheckinStore()
+    log.info("store 読込", extra=store.report)
+    committer = GroupCommitter(store)
+    await committer.start()
+    server = await asyncio.start_server(
+        lambda r, w: handle(committer, r, w), host, port)
+    log.info("record.py listening", extra={"host": host, "port": port})
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    setup_logging("record.log")
+    asyncio.run(main())
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+shared_index.py – ワーカー間で共有するメンバー表 + 日付インデックス（mmap）
+────────────────────────────────────────
+- 1 つのファイルを全ワーカーが MAP_SHARED で開く。名簿と直近の日付インデックスは全ワーカーで 1 部
+  （各ワーカーは別に store の今月分の列も持つ。追記前の取り込みとスナップショット用で、
+  ホットな 1 か月分に収まる）
+- 書き込みは .lock の flock を持つ 1 プロセスだけ。版カウンタ（seq）が奇数の間は書き込み中
+- 読み手はロック無し。読む前後で seq が同じなら一貫した値（違えば読み直す）
+- 日付は DAY_SLOTS 日分のリング。載っていない日は None を返し、呼び出し側が store を見る
+- メンバー枠は追記のみ（枠番号が変わらないので各ワーカーの uid → 枠番号キャッシュが腐らない）
+- 書き手が途中で落ちて seq が奇数のまま残っていたら seq だけ直す（枠は消さない）。
+  形式が違うなどで丸ごと作り直すときは epoch を進め、読み手は枠番号キャッシュを捨てる
+
+レイアウト（little-endian）:
+  ヘッダ    MAGIC | 版 u32 | seq u64 | 枠数 u32 | 名簿の版 u32 | members.json の mtime u64 | epoch u32
+  メンバー  MAX_MEMBERS × (名簿順 u16 | uid 長 u8 | uid 63B | 名前長 u8 | 名前 95B)
+  日付      DAY_SLOTS × (日番号 i32 | 投稿済みビット MAX_MEMBERS/8 B)
+"""
+
+from __future__ import annotations
+import os, mmap, time, fcntl, struct, threading, logging
+from contextlib import contextmanager
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+MAX_MEMBERS = 512                # LINE グループの上限 500 人 + 余裕
+UID_BYTES   = 63                 # 枠に入る uid の長さ（超える uid は載せない）
+DAY_SLOTS   = 64
+
+MAGIC  = b"MIDX"
+LAYOUT = 2
+HEAD   = struct.Struct("<4sIQIIQI")
+MEMBER = struct.Struct("<HB63sB95s")
+BITS   = MAX_MEMBERS // 8
+DAY    = struct.Struct(f"<i{BITS}s")
+U32    = struct.Struct("<I")
+U64    = struct.Struct("<Q")
+I32    = struct.Struct("<i")
+
+SEQ_OFF, COUNT_OFF, GEN_OFF, MTIME_OFF, EPOCH_OFF = 8, 16, 20, 24, 32
+MEMBERS_OFF = 64
+DAYS_OFF    = MEMBERS_OFF + MAX_MEMBERS * MEMBER.size
+SIZE        = DAYS_OFF + DAY_SLOTS * DAY.size
+NO_DAY      = -(1 << 31)
+SPIN_LIMIT  = 10000              # 書き手が途中で落ちて seq が奇数のまま → 諦めて None
+
+
+def _clip(text: str, limit: int) -> bytes:
+    """utf-8 で limit バイト以内（文字の途中では切らない）"""
+    return text.encode("utf-8")[:limit].decode("utf-8", "ignore").encode("utf-8")
+
+
+class SharedIndex:
+    def __init__(self, path: Path):
+        self.path  = Path(path)
+        self.tlock = threading.RLock()          # flock はプロセス単位なのでスレッド間は別に守る
+        self._depth = 0
+        self._lock_fd = os.open(self.path.with_suffix(".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        self._keys: list[str] = []              # 枠番号 → uid（追記のみなので差分だけ読む）
+        self._slots: dict[str, int] = {}
+        self._epoch = None                      # _keys / _slots を作ったときの epoch
+        with self._locked():
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size != SIZE:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, SIZE)
+                self.mm = mmap.mmap(fd, SIZE)
+            finally:
+                os.close(fd)
+            magic, layout, seq, *_ = HEAD.unpack_from(self.mm, 0)
+            if magic != MAGIC or layout != LAYOUT:
+                self._wipe()
+            elif seq & 1:                       # 書き手が書き込み途中で落ちた
+                log.warning("共有インデックスの seq を修復します", extra={"seq": seq})
+                U64.pack_into(self.mm, SEQ_OFF, seq + 1)
+
+    def _wipe(self):
+        """丸ごと作り直す。枠番号が変わるので epoch を進めて各ワーカーのキャッシュを捨てさせる"""
+        epoch = U32.unpack_from(self.mm, EPOCH_OFF)[0]
+        if self.version() >= 1 << 63:           # 中身がゴミなら seq も 0 から
+            U64.pack_into(self.mm, SEQ_OFF, 0)
+        with self._writing():
+            seq = self.version()
+            self.mm[SEQ_OFF + 8:] = bytes(SIZE - SEQ_OFF - 8)
+            HEAD.pack_into(self.mm, 0, MAGIC, LAYOUT, seq, 0, 0, 0, (epoch + 1) & 0xFFFFFFFF)
+            for i in range(DAY_SLOTS):
+                I32.pack_into(self.mm, DAYS_OFF + i * DAY.size, NO_DAY)
+
+    # ---------- 書き込み側（flock + seq を奇数にしてから書く）
+    @contextmanager
+    def _locked(self):
+        with self.tlock:
+            if self._depth == 0:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _writing(self):
+        with self._locked():
+            seq = self.version() | 1            # 落ちた書き手が奇数のまま残していても偶奇を保つ
+            U64.pack_into(self.mm, SEQ_OFF, seq)
+            try:
+                yield
+            finally:
+                U64.pack_into(self.mm, SEQ_OFF, seq + 1)
+
+    def _slot_for(self, uid: str) -> int | None:
+        """uid の枠番号。無ければ確保（_writing 中に呼ぶ）"""
+        i = self.slot(uid)
+        if i is not None:
+            return i
+        u = uid.encode("utf-8")
+        if len(u) > UID_BYTES:                  # 切り詰めると二度と一致しないので載せない
+            log.warning("uid が長すぎるので共有インデックスに載せません", extra={"uid": uid[:80]})
+            return None
+        n = U32.unpack_from(self.mm, COUNT_OFF)[0]
+        if n >= MAX_MEMBERS:
+            log.warning("共有インデックスのメンバー枠が一杯です", extra={"uid": uid})
+            return None
+        MEMBER.pack_into(self.mm, MEMBERS_OFF + n * MEMBER.size, 0, len(u), u, 0, b"")
+        U32.pack_into(self.mm, COUNT_OFF, n + 1)   # 枠を書いてから数を増やす
+        return self.slot(uid)
+
+    def set_members(self, members: dict[str, str], mtime: int = 0):
+        """members.json の内容を載せる（外れた uid は名前だけ消して枠は残す）"""
+        with self._writing():
+            order = {uid: pos for pos, uid in enumerate(members, 1)}
+            for uid in members:
+                self._slot_for(uid)
+            self._sync()
+            for i, uid in enumerate(self._keys):
+                name = _clip(members.get(uid, ""), 95)
+                u = uid.encode("utf-8")
+                MEMBER.pack_into(self.mm, MEMBERS_OFF + i * MEMBER.size,
+                                 order.get(uid, 0), len(u), u, len(name), name)
+            gen = U32.unpack_from(self.mm, GEN_OFF)[0]
+            U32.pack_into(self.mm, GEN_OFF, (gen + 1) & 0xFFFFFFFF)
+            U64.pack_into(self.mm, MTIME_OFF, mtime)
+
+    def mark(self, pairs: list[tuple[str, int]], today: int):
+        """(uid, 日番号) を投稿済みにする。リングに無い過去日は触らない（store で判定させる）"""
+        with self._writing():
+            for uid, day in pairs:
+                off = DAYS_OFF + (day % DAY_SLOTS) * DAY.size
+                current = I32.unpack_from(self.mm, off)[0]
+                if current != day:
+                    if day < today or day < current:
+                        continue
+                    DAY.pack_into(self.mm, off, day, b"")   # 新しい日の枠を空で開ける
+                i = self._slot_for(uid)
+                if i is not None:
+                    self.mm[off + 4 + i // 8] |= 1 << (i % 8)
+
+    def rebuild(self, days: dict[int, set[str]]):
+        """日付リングを丸ごと作り直す（store を読み込んだ直後、store の flock 中に呼ぶ）"""
+        with self._writing():
+            for i in range(DAY_SLOTS):
+                DAY.pack_into(self.mm, DAYS_OFF + i * DAY.size, NO_DAY, b"")
+            for day, uids in days.items():
+                bits = 0
+                for uid in uids:
+                    i = self._slot_for(uid)
+                    if i is not None:
+                        bits |= 1 << i
+                DAY.pack_into(self.mm, DAYS_OFF + (day % DAY_SLOTS) * DAY.size,
+                              day, bits.to_bytes(BITS, "little"))
+
+    # ---------- 読み取り側（ロック無し）
+    def version(self) -> int:
+        return U64.unpack_from(self.mm, SEQ_OFF)[0]
+
+    def member_gen(self) -> int:
+        return U32.unpack_from(self.mm, GEN_OFF)[0]
+
+    def members_mtime(self) -> int:
+        return U64.unpack_from(self.mm, MTIME_OFF)[0]
+
+    def epoch(self) -> int:
+        return U32.unpack_from(self.mm, EPOCH_OFF)[0]
+
+    def _sync(self):
+        """他プロセスが足した枠だけ読み足す。作り直されていればキャッシュを捨てて読み直す"""
+        with self.tlock:
+            epoch = self.epoch()
+            n = U32.unpack_from(self.mm, COUNT_OFF)[0]
+            if epoch != self._epoch or n < len(self._keys):
+                self._keys, self._slots, self._epoch = [], {}, epoch
+            for i in range(len(self._keys), n):
+                _, ul, u, _, _ = MEMBER.unpack_from(self.mm, MEMBERS_OFF + i * MEMBER.size)
+                uid = u[:ul].decode("utf-8")
+                self._slots[uid] = i
+                self._keys.append(uid)
+
+    def slot(self, uid: str) -> int | None:
+        if self.epoch() != self._epoch:
+            self._sync()
+        i = self._slots.get(uid)
+        if i is None:
+            self._sync()
+            i = self._slots.get(uid)
+        return i
+
+    def _read(self, fn):
+        for _ in range(SPIN_LIMIT):
+            seq = self.version()
+            if seq & 1:
+                time.sleep(0)                   # 書き込み中（数 µs で終わる）
+                continue
+            out = fn()
+            if self.version() == seq:
+                return out
+        return None
+
+    def has(self, uid: str, day: int) -> bool | None:
+        """投稿済みなら True。その日がリングに無い / uid を知らないときは None"""
+        def read():
+            off = DAYS_OFF + (day % DAY_SLOTS) * DAY.size
+            if I32.unpack_from(self.mm, off)[0] != day:
+                return None
+            i = self.slot(uid)
+            if i is None:
+                return None
+            return bool(self.mm[off + 4 + i // 8] >> (i % 8) & 1)
+        return self._read(read)
+
+    def posted_on(self, day: int) -> set[str] | None:
+        def read():
+            off = DAYS_OFF + (day % DAY_SLOTS) * DAY.size
+            d, raw = DAY.unpack_from(self.mm, off)
+            return (self.epoch(), raw) if d == day else None
+        got = self._read(read)
+        if got is None:
+            return None
+        epoch, raw = got
+        bits = int.from_bytes(raw, "little")
+        if epoch != self._epoch or bits.bit_length() > len(self._keys):
+            self._sync()
+        keys = self._keys
+        if epoch != self._epoch or bits.bit_length() > len(keys):
+            return None                         # 読んでいる間に作り直された → store に任せる
+        return {keys[i] for i in range(bits.bit_length()) if bits >> i & 1}
+
+    def members(self) -> dict[str, str] | None:
+        """uid → 名前（members.json の順）。読めなければ None"""
+        def read():
+            n = U32.unpack_from(self.mm, COUNT_OFF)[0]
+            rows = []
+            for i in range(n):
+                pos, ul, u, nl, name = MEMBER.unpack_from(self.mm, MEMBERS_OFF + i * MEMBER.size)
+                if pos:
+                    # 書き込みと重なった名前は壊れていることがある → 置換して seq の再確認に任せる
+                    rows.append((pos, u[:ul].decode("utf-8", "replace"),
+                                  name[:nl].decode("utf-8", "replace")))
+            return rows
+        rows = self._read(read)
+        return None if rows is None else {uid: name for _, uid, name in sorted(rows)}
+
+    def close(self):
+        self.mm.close()
+        os.close(self._lock_fd)
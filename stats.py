@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+stats.py – 連続記録・出席率・ランキングの集計
+────────────────────────────────────────
+- 投稿のたびに streak を更新（bot.py）
+- 毎晩の確定時に前日の 0/1/2 行で出席率と streak を更新（daily_check.py）
+- 表示用テキストは更新時に作っておき、問い合わせは stats.json を読むだけ
+"""
+
+from __future__ import annotations
+import json, fcntl, threading, logging
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+
+from store import write_atomic
+
+BASE = Path(__file__).resolve().parent
+
+log = logging.getLogger(__name__)
+
+STATS_PATH = BASE / "stats.json"
+LOCK_PATH  = BASE / ".stats.lock"
+
+
+def _empty() -> dict:
+    return {"version": 0, "month": None, "finalized": None,
+            "members": {}, "ranking_text": "", "streak_text": ""}
+
+
+def _member(state: dict, uid: str, name: str) -> dict:
+    m = state["members"].setdefault(uid, {
+        "name": name, "current": 0, "longest": 0, "last_day": None,
+        "posted": 0, "days": 0,
+    })
+    m["name"] = name
+    return m
+
+
+def rate(m: dict) -> float:
+    return m["posted"] / m["days"] if m["days"] else 0.0
+
+
+# ────────────────── 表示テキスト（更新時に作成）
+def _render(state: dict):
+    members = list(state["members"].values())
+    ranked = sorted(members, key=lambda m: (-rate(m), -m["current"], -m["longest"]))
+    month = state["month"] or "-"
+    lines = [f"🏆 {month} 出席率ランキング"]
+    for i, m in enumerate(ranked, 1):
+        lines.append(f"{i}. {m['name']} {rate(m) * 100:.0f}%"
+                     f"（{m['posted']}/{m['days']}日・連続{m['current']}日）")
+    state["ranking_text"] = "\n".join(lines)
+
+    by_streak = sorted(members, key=lambda m: (-m["current"], -m["longest"]))
+    lines = ["🔥 連続記録"]
+    lines += [f"{m['name']}: 現在{m['current']}日 / 最長{m['longest']}日" for m in by_streak]
+    state["streak_text"] = "\n".join(lines)
+
+    for m in members:
+        m["text"] = (f"{m['name']}は現在{m['current']}日連続"
+                     f"（最長{m['longest']}日、今月の出席率{rate(m) * 100:.0f}%）")
+
+
+class Stats:
+    """stats.json の読み書き。mtime が変わった時だけ読み直す"""
+
+    def __init__(self, path: Path = STATS_PATH, lock_path: Path = LOCK_PATH):
+        self.path      = Path(path)
+        self.lock_path = Path(lock_path)
+        self._state    = _empty()
+        self._mtime    = None
+        self.lock      = threading.Lock()
+
+    # ---------- 読み込み
+    def state(self) -> dict:
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return self._state
+        with self.lock:
+            if mtime != self._mtime:
+                try:
+                    self._state = json.loads(self.path.read_text(encoding="utf-8"))
+                    self._mtime = mtime
+                except Exception as e:
+                    log.warning("stats.json 読込失敗", extra={"error": str(e)})
+            return self._state
+
+    # ---------- 書き込み（プロセス間ロック）
+    @contextmanager
+    def _update(self):
+        with open(self.lock_path, "a") as lk:
+            fcntl.flock(lk, fcntl.LOCK_EX)
+            try:
+                state = _empty()
+                if self.path.exists():
+                    try:
+                        state = json.loads(self.path.read_text(encoding="utf-8"))
+                    except Exception as e:
+                        log.warning("stats.json 破損 → 作り直し", extra={"error": str(e)})
+                yield state
+                state["version"] += 1
+                _render(state)
+                write_atomic(self.path, json.dumps(state, ensure_ascii=False))
+            finally:
+                fcntl.flock(lk, fcntl.LOCK_UN)
+
+    def check_in(self, uid: str, name: str, day: date):
+        """投稿時。当日分の streak だけ先に伸ばす"""
+        with self._update() as state:
+            m = _member(state, uid, name)
+            today = day.isoformat()
+            if m["last_day"] == today:
+                return
+            yesterday = (day - timedelta(days=1)).isoformat()
+            m["current"] = m["current"] + 1 if m["last_day"] == yesterday else 1
+            m["longest"] = max(m["longest"], m["current"])
+            m["last_day"] = today
+
+    def finalize(self, day: date, statuses: dict[str, tuple[str, int]]):
+        """前日の確定。statuses は uid -> (名前, 0/1/2)"""
+        with self._update() as state:
+            key = day.isoformat()
+            if state["finalized"] and state["finalized"] >= key:
+                return                     # 二重実行は無視
+            month = key[:7]
+            if state["month"] != month:
+                state["month"] = month
+                for m in state["members"].values():
+                    m["posted"] = m["days"] = 0
+            prev = (day - timedelta(days=1)).isoformat()
+            for uid, (name, v) in statuses.items():
+                m = _member(state, uid, name)
+                if v == 2:                 # 除外日は出席率にも streak にも影響させない
+                    if m["last_day"] == prev:
+                        m["last_day"] = key    # 翌日の投稿が「前日から連続」と見えるよう繋ぎ目を進める
+                    continue
+                m["days"] += 1
+                if v == 0:
+                    m["posted"] += 1
+                    # bot を経由しない投稿（record.py）でも streak を繋ぐ
+                    if m["last_day"] is None or m["last_day"] < key:
+                        m["current"] = m["current"] + 1 if m["last_day"] == prev else 1
+                        m["longest"] = max(m["longest"], m["current"])
+                        m["last_day"] = key
+                elif m["last_day"] is None or m["last_day"] <= key:
+                    m["current"] = 0
+            state["finalized"] = key
+
+    # ---------- 問い合わせ（計算済みテキストを返すだけ）
+    def ranking_text(self) -> str:
+        return self.state()["ranking_text"] or "まだ記録がありません。"
+
+    def streak_text(self, name: str = "") -> str | None:
+        state = self.state()
+        if not name:
+            return state["streak_text"] or "まだ記録がありません。"
+        for m in state["members"].values():
+            if m["name"] == name:
+                return m.get("text")
+        return None
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+stats_api.py – ダッシュボード向け JSON（読み取り専用）
+────────────────────────────────────────
+- /api/progress  各メンバーの今月の忘れ回数
+- /api/balances  今月の収支（精算と同じ計算）
+- /api/streaks   連続記録・出席率（stats.json）
+
+台帳・名簿・stats.json の版から ETag を作り、版が変わった時だけ集計と
+JSON 化をやり直す。If-None-Match が一致すれば 304 を返すだけ。
+"""
+
+from __future__ import annotations
+import json, hashlib, threading
+
+from ledger import settle
+
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = [t.strip() for t in header.split(",")]
+    bare = etag.removeprefix("W/")
+    return any(t.removeprefix("W/") == bare for t in tags)
+
+
+class StatsView:
+    def __init__(self, ledger, registry, stats):
+        self.ledger   = ledger
+        self.registry = registry
+        self.stats    = stats
+        self.lock     = threading.Lock()
+        self.version  = None
+        self.etag     = None
+        self.bodies: dict[str, bytes] = {}
+
+    def _version(self) -> str:
+        # 名簿は members.json の mtime ではなく registry が実際に返す版を使う
+        # （共有インデックスへの反映は MEMBERS_POLL 秒遅れるので、mtime だと古い名前に新しい ETag が付く）
+        return f"{self.ledger.version()}:{self.registry.version()}:{self.stats.state()['version']}"
+
+    def _rebuild(self, version: str):
+        members = dict(self.registry.members())
+        balance, missed = settle(self.ledger.days())
+        uids = list(members) + [u for u in balance if u not in members]
+        state = self.stats.state()
+
+        def dump(obj) -> bytes:
+            return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+        self.bodies = {
+            "progress": dump({"members": [
+                {"uid": u, "name": members.get(u, u), "missed": missed.get(u, 0)} for u in uids]}),
+            "balances": dump({"members": [
+                {"uid": u, "name": members.get(u, u), "yen": round(balance.get(u, 0), 2)} for u in uids]}),
+            "streaks": dump({"month": state["month"], "finalized": state["finalized"], "members": [
+                {"uid": u, "name": m["name"], "current": m["current"], "longest": m["longest"],
+                 "posted": m["posted"], "days": m["days"]}
+                for u, m in state["members"].items()]}),
+        }
+        self.version = version
+        self.etag = 'W/"' + hashlib.sha1(version.encode()).hexdigest()[:16] + '"'
+
+    def get(self, name: str, if_none_match: str | None = None) -> tuple[int, bytes, str]:
+        """(ステータス, 本文, ETag)。版が同じなら stat 数回で済む"""
+        version = self._version()
+        with self.lock:
+            if version != self.version:
+                self._rebuild(version)
+            etag, body = self.etag, self.bodies[name]
+        if etag_matches(if_none_match, etag):
+            return 304, b"", etag
+        return 200, body, etag
@@ -0,0 +1,684 @@
+# -*- coding: utf-8 -*-
+"""
+store.py – 投稿記録ストア（スナップショット + WAL）
+────────────────────────────────────────
+store/
+  snapshot-<seq>.bin   ある時点までの全件（本文の CRC 付き）
+  wal-<seq>.log        スナップショット以降の追記。1 件ごとに CRC 付きフレーム
+  segments/<YYYY-MM>.seg  閉じた月の全件（スナップショット形式を zlib 圧縮）
+  LOCK                 書き込みの間だけ持つ flock（gunicorn の複数ワーカーが交代で書く）
+  index.shm            ワーカー共有の名簿 + 直近の日付インデックス（shared_index.py）
+
+- 起動時は最新の正常なスナップショットを読み、それ以降の WAL だけ再生する
+- 壊れたフレームや書きかけの末尾は飛ばして報告（全体は読み込み失敗にしない）
+- WAL が SNAPSHOT_EVERY 件たまったら新しいスナップショットを作って WAL を切り替える
+- スナップショット作成時（SNAPSHOT_EVERY 件ごと + 月が替わって最初の追記時）、STORE_HOT_MONTHS（既定 1 = 今月だけ）より前の月は
+  月ごとのセグメントへ移してメモリから外す。閉じた月は問い合わせが来た時だけ読む
+  （webhook / daily_check の常駐データは何年動かしても 1〜2 か月分）
+- 書き込みは LOCK を取り、他プロセスが足した WAL の続きを読み込んでから追記する
+  （重複チェックと追記が全プロセスを通して 1 つずつ進む）。別プロセスが
+  スナップショットを切っていたら読み直す
+- 「今日もう投稿したか」はまず index.shm をロック無しで見る。載っていない日だけ自前の列を見る
+  （自前の列は各ワーカーが持つが、閉じた月はセグメントへ出すので今月分だけ）
+- 初回は log.json / checkins.jsonl から取り込む（壊れた log.json は警告して飛ばす）
+- メモリ上は uid を小さな整数 ID に置き換え、(メンバー ID, JST 日番号, epoch 秒) の
+  array 3 本で持つ。日付の問い合わせは整数比較だけで済む
+
+WAL フレーム:  MAGIC(2) | 長さ u32 | crc32 u32 | "uid\\tts"(utf-8)
+"""
+
+from __future__ import annotations
+import os, re, sys, json, struct, zlib, fcntl, tempfile, threading, logging
+from array import array
+from contextlib import contextmanager
+from datetime import date, datetime, timezone, timedelta
+from pathlib import Path
+
+from shared_index import SharedIndex, DAY_SLOTS
+
+BASE = Path(__file__).resolve().parent
+
+log = logging.getLogger(__name__)
+
+STORE_DIR      = BASE / "store"
+LOG_PATH       = BASE / "log.json"
+JOURNAL_PATH   = BASE / "checkins.jsonl"
+MEMBERS_PATH   = BASE / "members.json"
+
+SNAPSHOT_EVERY = int(os.getenv("STORE_SNAPSHOT_EVERY", "1000"))
+KEEP_SNAPSHOTS = 2
+HOT_MONTHS     = max(1, int(os.getenv("STORE_HOT_MONTHS", "1")))
+COLD_CACHE     = 3                           # 読み込んだ閉じた月をいくつ残すか
+
+MAGIC      = b"\xc7\x1e"
+FRAME      = struct.Struct("<2sII")          # magic, 長さ, crc32
+SNAP_MAGIC = b"CSNP"
+SNAP_HEAD  = struct.Struct("<4sIQIIQ")       # magic, 版, wal_seq, 件数, crc32, 本文長
+MAX_RECORD = 4096
+MAX_UID    = 63                              # uid の utf-8 バイト数上限（LINE の uid は 33 文字）
+
+JST = timezone(timedelta(hours=9))
+JST_OFFSET = 9 * 3600
+EPOCH_DAY  = date(1970, 1, 1).toordinal()
+
+
+def to_jst(ts: str) -> datetime:
+    dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    return dt.replace(tzinfo=JST) if dt.tzinfo is None else dt.astimezone(JST)
+
+
+def day_number(day: str | date) -> int:
+    """JST 日付 → 1970-01-01 からの日数"""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return day.toordinal() - EPOCH_DAY
+
+
+def day_string(n: int) -> str:
+    return date.fromordinal(n + EPOCH_DAY).isoformat()
+
+
+def today_number() -> int:
+    return day_number(datetime.now(JST).date())
+
+
+def hot_start(months: int = HOT_MONTHS, today: date | None = None) -> int:
+    """この日番号より前の月は閉じた月（セグメント行き）"""
+    today = today or datetime.now(JST).date()
+    y, m = divmod(today.year * 12 + today.month - 1 - (months - 1), 12)
+    return day_number(date(y, m + 1, 1))
+
+
+def month_range(month: str) -> tuple[int, int]:
+    """"YYYY-MM" → (初日, 翌月初日) の日番号"""
+    y, m = map(int, month.split("-"))
+    ny, nm = divmod(y * 12 + m, 12)
+    return day_number(date(y, m, 1)), day_number(date(ny, nm + 1, 1))
+
+
+# ────────────────── uid ⇔ 整数 ID
+class Interner:
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.keys: list[str] = []
+
+    def id(self, key: str) -> int:
+        i = self.ids.get(key)
+        if i is None:
+            i = self.ids[key] = len(self.keys)
+            self.keys.append(sys.intern(key))
+        return i
+
+    def get(self, key: str) -> int | None:
+        return self.ids.get(key)
+
+
+# ────────────────── エンコード
+def valid_uid(uid) -> bool:
+    """WAL（タブ区切り）とスナップショットに載せられる uid か"""
+    return isinstance(uid, str) and 0 < len(uid.encode("utf-8")) <= MAX_UID and "\t" not in uid
+
+
+def encode(uid: str, ts: str) -> bytes:
+    payload = f"{uid}\t{ts}".encode("utf-8")
+    return FRAME.pack(MAGIC, len(payload), zlib.crc32(payload)) + payload
+
+
+def scan_wal(data: bytes) -> tuple[list[tuple[str, str]], int, int]:
+    """(レコード, 飛ばした件数, 最後の正常フレームの終端)"""
+    records, skipped, pos, good_end = [], 0, 0, 0
+    n = len(data)
+    while pos + FRAME.size <= n:
+        magic, length, crc = FRAME.unpack_from(data, pos)
+        start, end = pos + FRAME.size, pos + FRAME.size + length
+        if magic == MAGIC and length <= MAX_RECORD and end <= n \
+                and zlib.crc32(data[start:end]) == crc:
+            try:
+                uid, ts = data[start:end].decode("utf-8").split("\t", 1)
+                records.append((uid, ts))
+                pos = good_end = end
+                continue
+            except ValueError:
+                pass
+        # 壊れている → 次の MAGIC まで読み飛ばす
+        skipped += 1
+        nxt = data.find(MAGIC, pos + 1)
+        if nxt < 0:
+            pos = n
+            break
+        pos = nxt
+    if pos < n:
+        skipped += 1                             # ヘッダにも満たない書きかけの末尾
+    return records, skipped, good_end
+
+
+def _le(a: array) -> bytes:
+    if sys.byteorder == "big":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+
+def _from_le(typecode: str, data: bytes) -> array:
+    a = array(typecode)
+    a.frombytes(data)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+
+def encode_snapshot(keys: list[str], member: array, day: array, epoch: array,
+                    wal_seq: int) -> bytes:
+    """版 3: uid 表（長さ u16）+ 列（メンバー ID u32 / 日番号 i32 / epoch 秒 i64）"""
+    body = bytearray(struct.pack("<I", len(keys)))
+    for k in keys:
+        u = k.encode("utf-8")
+        body += struct.pack("<H", len(u)) + u
+    body += _le(member) + _le(day) + _le(epoch)
+    body = bytes(body)
+    return SNAP_HEAD.pack(SNAP_MAGIC, 3, wal_seq, len(member), zlib.crc32(body), len(body)) + body
+
+
+def decode_snapshot(data: bytes):
+    """版 2 / 3 → ("cols", (keys, member, day, epoch), wal_seq)（uid 長が u8 / u16）
+       版 1 → ("rows", [(uid, ts)], wal_seq)"""
+    magic, version, wal_seq, count, crc, length = SNAP_HEAD.unpack_from(data, 0)
+    body = data[SNAP_HEAD.size:SNAP_HEAD.size + length]
+    if magic != SNAP_MAGIC or len(body) != length or zlib.crc32(body) != crc:
+        raise ValueError("snapshot checksum mismatch")
+    if version == 1:
+        records, pos = [], 0
+        for _ in range(count):
+            ul = body[pos]; uid = body[pos + 1:pos + 1 + ul].decode("utf-8"); pos += 1 + ul
+            tl = body[pos]; ts = body[pos + 1:pos + 1 + tl].decode("utf-8"); pos += 1 + tl
+            records.append((uid, ts))
+        return "rows", records, wal_seq
+    (nkeys,) = struct.unpack_from("<I", body, 0)
+    keys, pos = [], 4
+    width = 1 if version == 2 else 2
+    for _ in range(nkeys):
+        ul = int.from_bytes(body[pos:pos + width], "little"); pos += width
+        keys.append(body[pos:pos + ul].decode("utf-8")); pos += ul
+    member = _from_le("I", body[pos:pos + 4 * count]); pos += 4 * count
+    day    = _from_le("i", body[pos:pos + 4 * count]); pos += 4 * count
+    epoch  = _from_le("q", body[pos:pos + 8 * count])
+    return "cols", (keys, member, day, epoch), wal_seq
+
+
+def encode_segment(keys: list[str], member: array, day: array, epoch: array) -> bytes:
+    return zlib.compress(encode_snapshot(keys, member, day, epoch, 0), 9)
+
+
+def decode_segment(data: bytes) -> tuple[list[str], array, array, array]:
+    _, cols, _ = decode_snapshot(zlib.decompress(data))
+    return cols
+
+
+def _seq(path: Path) -> int:
+    return int(path.stem.split("-")[1])
+
+
+def _fsync_dir(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path: Path, data: str | bytes):
+    """一時ファイルに書いて fsync → rename → ディレクトリも fsync（途中で落ちても旧版か新版のどちらか）"""
+    path = Path(path)
+    # 一時ファイル名は書き手ごとに別（同じ名前だと同時に書いたとき片方の rename が失敗する）
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    try:
+        os.fchmod(fd, 0o644)                    # mkstemp は 0600 で作るので従来の権限に揃える
+        with os.fdopen(fd, "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    _fsync_dir(path.parent)
+
+
+# ────────────────── ストア本体
+class CheckinStore:
+    def __init__(self, root: Path = STORE_DIR, readonly: bool = False,
+                 snapshot_every: int = SNAPSHOT_EVERY, shared_index: bool = True):
+        self.root     = Path(root)
+        self.readonly = readonly
+        self.snapshot_every = snapshot_every
+        self.lock     = threading.RLock()       # スレッド間。プロセス間は LOCK の flock
+        self._flock_depth = 0
+        self.index: SharedIndex | None = None
+        self.hot_from = hot_start()               # これより前の日はセグメント行き
+        self._reset()
+
+        if readonly:
+            self._load()
+            if self._fresh():
+                self._import_legacy()
+            return
+
+        self.root.mkdir(exist_ok=True)
+        self._lock_fd = os.open(self.root / "LOCK", os.O_RDWR | os.O_CREAT, 0o644)
+        if shared_index:
+            self.index = SharedIndex(self.root / "index.shm")
+        with self.lock, self._flocked():
+            self._load()
+            self._open_wal()
+            if self._fresh():
+                self._import_legacy()
+            if self.day and min(self.day) < hot_start():
+                self._snapshot()                 # 旧形式 / 月をまたいだ再起動 → 先に月を閉じる
+            self._publish()
+
+    def _reset(self):
+        self.uids     = Interner()
+        self.member   = array("I")              # メンバー ID
+        self.day      = array("i")              # JST 日番号
+        self.epoch    = array("q")              # epoch 秒
+        self.by_day: dict[int, int] = {}        # 日番号 → メンバー ID のビット集合
+        self.seg_dir  = self.root / "segments"
+        self.segments = {p.stem for p in self.seg_dir.glob("*.seg")}   # 閉じた月
+        self.cold: dict[str, dict[int, int]] = {}                        # 読み込み済みの閉じた月
+        self.cold_before = max((month_range(m)[1] for m in self.segments), default=-(1 << 31))
+        self.report   = {"snapshot": None, "wal_records": 0, "skipped": 0, "bad_ts": 0}
+        self.fd       = None
+        self.wal_seq  = 0
+        self.wal_count = 0
+        self.wal_pos  = 0                       # 現在の WAL のどこまで読んだか
+
+    def _fresh(self) -> bool:
+        return self.report["snapshot"] is None and all(
+            os.path.getsize(w) == 0 for w in self.root.glob("wal-*.log"))
+
+    @contextmanager
+    def _flocked(self):
+        """プロセス間の書き込みロック（self.lock 保持中に使う。入れ子可）"""
+        if self._flock_depth == 0:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        self._flock_depth += 1
+        try:
+            yield
+        finally:
+            self._flock_depth -= 1
+            if self._flock_depth == 0:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _publish(self):
+        """共有インデックスの日付リングを作り直す（flock 保持中に呼ぶ）"""
+        if self.index is None:
+            return
+        today = today_number()
+        lo = max(hot_start(), today - DAY_SLOTS + 2)
+        self.index.rebuild({d: self._members_of(self.by_day.get(d, 0)) for d in range(lo, today + 1)})
+
+    # ---------- 起動時の読み込み
+    def _load(self):
+        base_seq = 0
+        for snap in sorted(self.root.glob("snapshot-*.bin"), key=_seq, reverse=True):
+            try:
+                kind, payload, base_seq = decode_snapshot(snap.read_bytes())
+            except Exception as e:
+                log.warning("スナップショット破損 → 1 つ前を使います",
+                            extra={"file": snap.name, "error": str(e)})
+                continue
+            if kind == "rows":
+                for r in payload:
+                    self._index(*r)
+            else:
+                keys, self.member, self.day, self.epoch = payload
+                for k in keys:
+                    self.uids.id(k)
+                for m, d in zip(self.member, self.day):
+                    self.by_day[d] = self.by_day.get(d, 0) | (1 << m)
+            self.report["snapshot"] = snap.name
+            break
+
+        self.wal_seq = base_seq + 1
+        for wal in sorted(self.root.glob("wal-*.log"), key=_seq):
+            seq = _seq(wal)
+            if seq <= base_seq:
+                continue
+            try:
+                data = wal.read_bytes()
+            except FileNotFoundError:        # 書き込み側が掃除した直後
+                continue
+            records, skipped, good_end = scan_wal(data)
+            for r in records:
+                self._index(*r)
+            self.report["wal_records"] += len(records)
+            self.report["skipped"] += skipped
+            if skipped:
+                log.warning("壊れたレコードを飛ばしました", extra={"file": wal.name, "skipped": skipped})
+            self.wal_seq = seq
+            self.wal_count = len(records)
+            self.wal_pos = len(data)
+            if not self.readonly and good_end < len(data) and data.find(MAGIC, good_end + 1) < 0:
+                # 書きかけの末尾は切り落として続きから追記
+                os.truncate(wal, good_end)
+                self.wal_pos = good_end
+
+    def _catch_up(self):
+        """他プロセスの追記を取り込む（flock 保持中に呼ぶ）"""
+        rotated = (self.root / f"snapshot-{self.wal_seq}.bin").exists() \
+            or os.fstat(self.fd).st_nlink == 0
+        if rotated:                              # 別プロセスがスナップショットを切った → 読み直す
+            os.close(self.fd)
+            self._reset()
+            self._load()
+            self._open_wal()
+            return
+        size = os.fstat(self.fd).st_size
+        if size <= self.wal_pos:
+            return
+        path = self.root / f"wal-{self.wal_seq}.log"
+        with open(path, "rb") as f:
+            f.seek(self.wal_pos)
+            data = f.read(size - self.wal_pos)
+        records, skipped, good_end = scan_wal(data)
+        for r in records:
+            self._index(*r)
+        self.wal_count += len(records)
+        self.report["wal_records"] += len(records)
+        self.report["skipped"] += skipped
+        if good_end < len(data) and data.find(MAGIC, good_end + 1) < 0:
+            os.truncate(path, self.wal_pos + good_end)   # 落ちたワーカーの書きかけ
+            self.wal_pos += good_end
+        else:
+            self.wal_pos = size
+
+    def _index(self, uid: str, ts: str) -> int | None:
+        """列に足して JST 日番号を返す（読めない ts は None）"""
+        try:
+            epoch = int(to_jst(ts).timestamp())
+        except ValueError:
+            self.report["bad_ts"] += 1
+            return None
+        m = self.uids.id(uid)
+        d = (epoch + JST_OFFSET) // 86400
+        self.member.append(m)
+        self.day.append(d)
+        self.epoch.append(epoch)
+        self.by_day[d] = self.by_day.get(d, 0) | (1 << m)
+        return d
+
+    def _import_legacy(self):
+        """初回のみ: log.json（名前 or uid キー）と checkins.jsonl を取り込む"""
+        records = []
+        try:
+            name_to_id = {n: u for u, n in json.loads(MEMBERS_PATH.read_text(encoding="utf-8")).items()}
+        except Exception:
+            name_to_id = {}
+        if LOG_PATH.exists():
+            try:
+                logs = json.loads(LOG_PATH.read_text(encoding="utf-8"))
+            except ValueError as e:
+                log.warning("log.json が壊れています。読める ts だけ取り込みます", extra={"error": str(e)})
+                logs = _salvage_log(LOG_PATH.read_text(encoding="utf-8", errors="replace"))
+            for key, entries in logs.items():
+                uid = name_to_id.get(key, key)
+                for entry in entries if isinstance(entries, list) else []:
+                    ts = entry.get("ts") if isinstance(entry, dict) else entry
+                    if isinstance(ts, str):
+                        records.append((uid, ts))
+        if JOURNAL_PATH.exists():
+            with JOURNAL_PATH.open(encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                        records.append((rec["uid"], rec["ts"]))
+                    except (ValueError, KeyError):
+                        self.report["skipped"] += 1
+        ok = [r for r in records if valid_uid(r[0])]
+        self.report["skipped"] += len(records) - len(ok)
+        records = ok
+        if records and self.readonly:
+            for r in records:                  # 読むだけ（ストアには書かない）
+                self._index(*r)
+        elif records:
+            self.append_many(records)
+            log.info("旧ログを取り込みました", extra={"records": len(records)})
+
+    # ---------- 書き込み
+    def _open_wal(self):
+        path = self.root / f"wal-{self.wal_seq}.log"
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _append_locked(self, records: list[tuple[str, str]]):
+        """まとめて 1 回の write + fsync（lock + flock 保持中、_catch_up の後に呼ぶ）"""
+        bad = [uid for uid, _ in records if not valid_uid(uid)]
+        if bad:
+            raise ValueError(f"invalid uid: {bad[0][:80]!r}")
+        data = b"".join(encode(uid, ts) for uid, ts in records)
+        os.write(self.fd, data)
+        os.fsync(self.fd)
+        self.wal_pos += len(data)
+        marks = [(r[0], d) for r in records if (d := self._index(*r)) is not None]
+        if self.index is not None and marks:
+            self.index.mark(marks, today_number())
+        self.wal_count += len(records)
+        # 件数に達したとき、または月が替わって今月の範囲が動いたとき（その月の最初の追記）
+        if self.wal_count >= self.snapshot_every or hot_start() != self.hot_from:
+            try:
+                self._snapshot()
+            except Exception:
+                # 追記は WAL に fsync 済み。失敗を呼び出し側に返さず、snapshot_every 件後に再挑戦
+                log.exception("スナップショット作成失敗")
+                self.wal_count = 0
+
+    def append_many(self, records: list[tuple[str, str]]):
+        if self.readonly:
+            raise RuntimeError("read-only store")
+        with self.lock, self._flocked():
+            self._catch_up()
+            self._append_locked(records)
+
+    def append(self, uid: str, ts: str):
+        self.append_many([(uid, ts)])
+
+    def append_if_new(self, uid: str, ts: str) -> bool:
+        """その JST 日付に uid の記録がまだ無ければ追記して True（全ワーカーで 1 回だけ）"""
+        d = (int(to_jst(ts).timestamp()) + JST_OFFSET) // 86400
+        if self.index is not None and self.index.has(uid, d):
+            return False                         # ロック無しで弾ける 2 回目以降
+        with self.lock, self._flocked():
+            self._catch_up()
+            if self._has_local(uid, d):
+                return False
+            self._append_locked([(uid, ts)])
+            return True
+
+    def checkpoint(self):
+        """今すぐスナップショットを切る（閉じた月もセグメントへ）"""
+        with self.lock, self._flocked():
+            self._catch_up()
+            self._snapshot()
+
+    def _snapshot(self):
+        """閉じた月をセグメントへ移し、残りを書き出して新しい WAL に切り替える（lock + flock 保持中に呼ぶ）"""
+        self._close_months()
+        snap = self.root / f"snapshot-{self.wal_seq}.bin"
+        tmp = snap.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(encode_snapshot(self.uids.keys, self.member, self.day, self.epoch,
+                                    self.wal_seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, snap)
+        os.close(self.fd)
+        self.wal_seq += 1
+        self.wal_count = 0
+        self.wal_pos = 0
+        self._open_wal()
+        _fsync_dir(self.root)
+
+        # 古いスナップショットと、それより前の WAL を掃除
+        snaps = sorted(self.root.glob("snapshot-*.bin"), key=_seq)
+        for old in snaps[:-KEEP_SNAPSHOTS]:
+            old.unlink()
+        oldest = _seq(snaps[-KEEP_SNAPSHOTS]) if len(snaps) >= KEEP_SNAPSHOTS else 0
+        for wal in self.root.glob("wal-*.log"):
+            if _seq(wal) <= oldest:
+                wal.unlink()
+
+    def _close_months(self):
+        """hot_start() より前の記録を月ごとのセグメントへ統合し、メモリから外す"""
+        cutoff = self.hot_from = hot_start()
+        old = [i for i, d in enumerate(self.day) if d < cutoff]
+        if not old:
+            return
+        keys = self.uids.keys
+        by_month: dict[str, set[tuple[str, int]]] = {}
+        for i in old:
+            by_month.setdefault(day_string(self.day[i])[:7], set()).add((keys[self.member[i]], self.epoch[i]))
+
+        self.seg_dir.mkdir(exist_ok=True)
+        for month, rows in by_month.items():
+            path = self.seg_dir / f"{month}.seg"
+            if path.exists():                    # 遅れて届いた分 / 前回の途中終了分を重複なしで統合
+                k, m, _, e = decode_segment(path.read_bytes())
+                rows.update((k[a], b) for a, b in zip(m, e))
+            seg = Interner()
+            member, day, epoch = array("I"), array("i"), array("q")
+            for uid, e in sorted(rows, key=lambda r: r[1]):
+                member.append(seg.id(uid))
+                day.append((e + JST_OFFSET) // 86400)
+                epoch.append(e)
+            tmp = path.with_suffix(".tmp")
+            with open(tmp, "wb") as f:
+                f.write(encode_segment(seg.keys, member, day, epoch))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+            self.segments.add(month)
+            self.cold.pop(month, None)
+            self.cold_before = max(self.cold_before, month_range(month)[1])
+        _fsync_dir(self.seg_dir)
+
+        keep = [i for i, d in enumerate(self.day) if d >= cutoff]
+        self.member = array("I", (self.member[i] for i in keep))
+        self.day    = array("i", (self.day[i] for i in keep))
+        self.epoch  = array("q", (self.epoch[i] for i in keep))
+        self.by_day = {d: b for d, b in self.by_day.items() if d >= cutoff}
+        log.info("閉じた月をセグメントへ移しました",
+                 extra={"months": sorted(by_month), "records": len(old), "hot": len(keep)})
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if getattr(self, "_lock_fd", None) is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+    # ---------- 問い合わせ（整数比較のみ）
+    def __len__(self) -> int:
+        return len(self.member)
+
+    def _members_of(self, bits: int) -> set[str]:
+        keys, out, m = self.uids.keys, set(), 0
+        while bits:
+            if bits & 1:
+                out.add(keys[m])
+            bits >>= 1
+            m += 1
+        return out
+
+    def _cold_days(self, month: str) -> dict[int, int]:
+        """閉じた月の 日番号 → ビット集合（初回だけセグメントを展開）"""
+        days = self.cold.get(month)
+        if days is None:
+            days = {}
+            try:
+                keys, member, day, _ = decode_segment((self.seg_dir / f"{month}.seg").read_bytes())
+            except Exception as e:
+                log.warning("セグメントを読めません", extra={"month": month, "error": str(e)})
+                keys, member, day = [], (), ()
+            ids = [self.uids.id(k) for k in keys]
+            for m, d in zip(member, day):
+                days[d] = days.get(d, 0) | (1 << ids[m])
+            if len(self.cold) >= COLD_CACHE:
+                self.cold.pop(next(iter(self.cold)))
+            self.cold[month] = days
+        return days
+
+    def _bits(self, d: int) -> int:
+        bits = self.by_day.get(d, 0)
+        if d < self.cold_before:                 # 閉じた月かもしれない時だけ月名を作る
+            month = day_string(d)[:7]
+            if month in self.segments:
+                bits |= self._cold_days(month).get(d, 0)
+        return bits
+
+    def posted_on(self, day: str | date) -> set[str]:
+        """JST 日付に投稿した uid"""
+        d = day_number(day)
+        if self.index is not None:
+            shared = self.index.posted_on(d)
+            if shared is not None:
+                return shared
+        return self._members_of(self._bits(d))
+
+    def has(self, uid: str, day: str | date) -> bool:
+        d = day_number(day)
+        if self.index is not None:
+            shared = self.index.has(uid, d)
+            if shared is not None:
+                return shared
+        return self._has_local(uid, d)
+
+    def _has_local(self, uid: str, d: int) -> bool:
+        bits = self._bits(d)
+        m = self.uids.get(uid)
+        return m is not None and bool(bits >> m & 1)
+
+    def hits(self, start: str | date | None = None, end: str | date | None = None) -> set[tuple[str, str]]:
+        """期間内の {(JST 日付, uid)}"""
+        lo = day_number(start) if start else -(1 << 31)
+        hi = day_number(end) if end else (1 << 31) - 1
+        days = dict(self.by_day)
+        for month in sorted(self.segments):      # 範囲にかかる閉じた月だけ読む
+            first, after = month_range(month)
+            if first <= hi and after > lo:
+                for d, bits in self._cold_days(month).items():
+                    days[d] = days.get(d, 0) | bits
+        out = set()
+        for d, bits in days.items():
+            if lo <= d <= hi:
+                day = day_string(d)
+                out.update((day, uid) for uid in self._members_of(bits))
+        return out
+
+    def by_uid(self) -> dict[str, list[str]]:
+        """uid → JST の ISO 時刻（旧形式への書き出し用。閉じた月も全部読む）"""
+        out: dict[str, set[int]] = {}
+        for month in sorted(self.segments):
+            keys, member, _, epoch = decode_segment((self.seg_dir / f"{month}.seg").read_bytes())
+            for m, e in zip(member, epoch):
+                out.setdefault(keys[m], set()).add(e)
+        keys = self.uids.keys
+        for m, e in zip(self.member, self.epoch):
+            out.setdefault(keys[m], set()).add(e)
+        return {uid: [datetime.fromtimestamp(e, JST).isoformat() for e in sorted(es)]
+                for uid, es in out.items()}
+
+
+def _salvage_log(text: str) -> dict[str, list[str]]:
+    """壊れた log.json から "名前": [ ... "ts": "..." ... ] を拾えるだけ拾う"""
+    logs: dict[str, list[str]] = {}
+    key = None
+    for m in re.finditer(r'"([^"]+)"\s*:\s*\[|"ts"\s*:\s*"([^"]+)"|"(\d{4}-\d\d-\d\dT[^"]+)"', text):
+        if m.group(1):
+            key = m.group(1)
+            logs.setdefault(key, [])
+        elif key is not None:
+            logs[key].append(m.group(2) or m.group(3))
+    return logs